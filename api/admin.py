@@ -1,3 +1,39 @@
 from django.contrib import admin
 
+from .models import Event, Reservation, Subscription, Tag, WaitlistEntry
+
+
 # Register your models here.
+
+# the __str__ of these models follows their foreign keys, join them in the changelist query
+@admin.register(Event)
+class EventAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'capacity', 'capacity_left', 'reservation_count')
+    list_select_related = ('creator',)
+    raw_id_fields = ('creator',)
+
+
+@admin.register(Reservation)
+class ReservationAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'created_at')
+    list_select_related = ('user', 'event')
+    raw_id_fields = ('user', 'event')
+
+
+@admin.register(WaitlistEntry)
+class WaitlistEntryAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'ticket', 'created_at')
+    raw_id_fields = ('user', 'event')
+
+
+@admin.register(Subscription)
+class SubscriptionAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'max_amount', 'due_date')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+
+
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('name',)
+    search_fields = ('name',)
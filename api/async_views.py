@@ -0,0 +1,218 @@
+import asyncio
+import json
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException
+
+from . import views
+from .caching import cache_response, event_etag
+from .geocoding import ageocode
+from .live import broker, capacity_etag
+from .models import Event
+from .pagination import EventPagination
+from .serializers import EventCompactSerializer, EventSerializer
+from .tags import filter_by_tags
+
+
+# Async variants of the read endpoints and of the geocoding proxy, served when
+# the API runs under ASGI with ASYNC_VIEWS enabled (see api/urls.py). They
+# answer with the same payloads as their sync counterparts in api/views.py.
+
+
+def json_response(data, status=200):
+    # same compact encoding as DRF's JSONRenderer
+    return JsonResponse(data, status=status, safe=False,
+                        json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False})
+
+
+class AsyncView(View):
+    """
+    Methods implemented here run on the event loop; any other method is handed
+    to the sync DRF view `sync_view` in a worker thread.
+    """
+    sync_view = None
+    sync_handler = None
+    # cache_response(...) decorator applied to the whole view, as on the sync views
+    cache = None
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        if cls.sync_view is not None:
+            initkwargs.setdefault('sync_handler', sync_to_async(cls.sync_view.as_view()))
+        view = super().as_view(**initkwargs)
+        if cls.cache is not None:
+            view = cls.cache(view)
+        # token authenticated like the DRF views, which are csrf exempt as well
+        return csrf_exempt(view)
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        if method in self.http_method_names and hasattr(self, method):
+            try:
+                return await getattr(self, method)(request, *args, **kwargs)
+            except APIException as e:
+                # invalid cursor or fields, answered like DRF's exception handler does
+                return json_response({'detail': e.detail}, status=e.status_code)
+        if self.sync_handler is not None:
+            return await self.sync_handler(request, *args, **kwargs)
+        return await self.http_method_not_allowed(request, *args, **kwargs)
+
+
+async def paginated_events(request, queryset):
+    serializer = EventCompactSerializer(request)
+    paginator = EventPagination()
+    queryset = filter_by_tags(queryset, request)
+    # to_representation() reads the tags of the rows
+    to_representation = sync_to_async(serializer.to_representation)
+    page = await paginator.apaginate_queryset(serializer.values(queryset, paginator.ordering), request)
+    if page is None:
+        return json_response(await to_representation([row async for row in serializer.values(queryset)]))
+    return json_response({
+        'next': paginator.get_next_link(),
+        'results': await to_representation(page),
+    })
+
+
+# Class to view all events
+class EventListRetrieveView(AsyncView):
+    sync_view = views.EventListRetrieveView
+    cache = cache_response()
+
+    async def get(self, request):
+        return await paginated_events(request, Event.objects.all())
+
+
+class UpcomingEventsView(AsyncView):
+    sync_view = views.UpcomingEventsView
+    cache = cache_response()
+
+    async def get(self, request):
+        return await paginated_events(request, Event.objects.filter(date__gte=timezone.now()))
+
+
+# class to view a single event
+class EventRetrieveViewDestroy(AsyncView):
+    sync_view = views.EventRetrieveViewDestroy
+    cache = cache_response(event_kwarg='pk')
+
+    async def get(self, request, pk):
+        try:
+            event = await Event.objects.prefetch_related('tags').aget(pk=pk)
+        except Event.DoesNotExist:
+            return json_response({"message": "Event with id: {} does not exist".format(pk)}, status=404)
+        data = EventSerializer(event).data
+        response = json_response(data)
+        response['ETag'] = event_etag(event, data)
+        return response
+
+
+class EventCreatorInfoView(AsyncView):
+    cache = cache_response(event_kwarg='event_id')
+
+    async def get(self, request, event_id):
+        try:
+            event = await Event.objects.select_related('creator').only(
+                'creator__username', 'creator__first_name', 'creator__last_name'
+            ).aget(id=event_id)
+        except Event.DoesNotExist:
+            return json_response({
+                'error': 'Event not found',
+                'code': 'EVENT_NOT_FOUND'
+            }, status=404)
+
+        creator = event.creator
+        return json_response({
+            'username': creator.username,
+            'first_name': creator.first_name,
+            'last_name': creator.last_name
+        })
+
+
+# Live capacity_left of the events of ?ids=1,2,3 from the in-process broker (api/live.py):
+# a text/event-stream of the changes for EventSource clients, otherwise a conditional
+# long-poll, a request with the ETag of the current state waits for the next change
+class EventCapacityView(AsyncView):
+    sync_view = views.EventCapacityView
+
+    async def get(self, request):
+        event_ids, code = self.sync_view.parse_event_ids(request)
+        if code is not None:
+            return json_response({'error': self.sync_view.errors[code], 'code': code}, status=400)
+
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            response = StreamingHttpResponse(self.stream(event_ids), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            # nginx would buffer the stream otherwise
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        subscription = await broker.subscribe(event_ids)
+        try:
+            deadline = asyncio.get_running_loop().time() + settings.LIVE_LONG_POLL_TIMEOUT
+            while request.headers.get('If-None-Match') == capacity_etag(subscription.capacity()):
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0 or not await subscription.wait(timeout):
+                    break
+            capacity = subscription.capacity()
+        finally:
+            subscription.close()
+        etag = capacity_etag(capacity)
+        response = json_response(self.sync_view.payload(capacity))
+        response['ETag'] = etag
+        return get_conditional_response(request, etag=etag, response=response)
+
+    async def stream(self, event_ids):
+        # the current values first (delta null), then the changes; Django cancels the generator on disconnect
+        subscription = await broker.subscribe(event_ids)
+        try:
+            while True:
+                for update in subscription.updates():
+                    yield 'event: capacity\ndata: {}\n\n'.format(json.dumps(update, separators=(',', ':')))
+                if not await subscription.wait(settings.LIVE_KEEPALIVE_INTERVAL):
+                    yield ': keepalive\n\n'
+        finally:
+            subscription.close()
+
+
+# Geocoding, the upstream round trip doesn't hold a worker
+class GeocodeView(AsyncView):
+    async def post(self, request):
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body or b'{}')
+            except ValueError:
+                return json_response({'detail': 'JSON parse error'}, status=400)
+        else:
+            data = request.POST
+        address = data.get('address') if hasattr(data, 'get') else None
+        if not address:
+            return json_response({'error': 'Address parameter is required'}, status=400)
+
+        # Get API key from environment variable
+        if not settings.GEOCODING_API_KEY:
+            return json_response({'error': 'API key not configured'}, status=500)
+
+        try:
+            data = await ageocode(address)
+
+            if data['success']:
+                element = data['element']
+                return json_response({
+                    'address': element['streetName'],
+                    'latitude': element['latitude'],
+                    'longitude': element['longitude'],
+                    'streetNumber': element['streetNumber'],
+                    'city': element['locality'],
+                })
+            else:
+                return json_response({'error': 'No results found'}, status=404)
+
+        except (httpx.HTTPError, ValueError) as e:
+            return json_response({'error': f'API request failed: {str(e)}'}, status=500)
@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.db import connections, transaction
+from .caching import bump_events_version, invalidate_reserved_event_ids
+from .calendar import bump_calendar_months
+from .counters import count_reservations
+from .models import Event, EventTag, Reservation, Subscription, WaitlistEntry
+from .search import get_search_backend
+from .waitlist import promote_waiting
+
+
+def _delete_rows(model, pks, using):
+    # DELETE ... WHERE pk IN (...): no instances, signals or cascade, the callers keep the derived data in sync
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {} WHERE {} IN ({})'.format(
+            connection.ops.quote_name(model._meta.db_table), connection.ops.quote_name(model._meta.pk.column),
+            ', '.join(['%s'] * len(pks))
+        ), pks)
+        return cursor.rowcount
+
+
+def delete_in_chunks(queryset, fields=('pk',), on_chunk=None, chunk_size=None):
+    """
+    Deletes the rows of queryset with a bounded number of statements: per chunk
+    of chunk_size rows one SELECT of `fields` (the first one must be the primary
+    key) and one DELETE by primary key. Rows are never instantiated, so no
+    signals are sent and no cascade is collected; delete the dependent rows
+    first and pass on_chunk(rows) to keep derived data in sync. Returns the
+    number of deleted rows.
+
+    Each chunk is deleted with its on_chunk() writes in its own transaction,
+    so the locks are released between chunks and an interrupted run leaves
+    consistent data; running it again deletes the rest. The chunks are pk
+    ranges up to the last row that existed when the call started, the rows
+    written in the meantime (e.g. by on_chunk) are left alone.
+    """
+    chunk_size = chunk_size or settings.BULK_DELETE_CHUNK_SIZE
+    model = queryset.model
+    queryset = queryset.order_by('pk')
+    last = queryset.values_list('pk', flat=True).last()
+    if last is None:
+        return 0
+    queryset = queryset.filter(pk__lte=last)
+    total = 0
+    after = None
+    while True:
+        with transaction.atomic(using=queryset.db):
+            chunk = queryset if after is None else queryset.filter(pk__gt=after)
+            rows = list(chunk.values_list(*fields)[:chunk_size])
+            if not rows:
+                break
+            if on_chunk is not None:
+                on_chunk(rows)
+            total += _delete_rows(model, [row[0] for row in rows], queryset.db)
+        if len(rows) < chunk_size:
+            break
+        after = rows[-1][0]
+    return total
+
+
+def delete_reservations(queryset, chunk_size=None):
+    """
+    Gives the seats back and updates the reservation counters of the events
+    and users, chunk by chunk. The waitlists take the freed seats of a chunk
+    in its transaction; the promoted reservations are newer than the deletion
+    and aren't deleted with the others.
+    """
+    def on_chunk(rows):
+        # rows of (id, user_id, event_id)
+        event_ids = {event_id for _, _, event_id in rows}
+        count_reservations([(user_id, event_id) for _, user_id, event_id in rows], -1, seats=True)
+        invalidate_reserved_event_ids(*{user_id for _, user_id, _ in rows})
+        bump_events_version(*event_ids, listed=False)
+        promote_waiting(event_ids, chunk_size)
+
+    return delete_in_chunks(queryset, ('pk', 'user_id', 'event_id'), on_chunk, chunk_size)
+
+
+def delete_events(queryset, chunk_size=None):
+    """
+    Deletes the events and everything that references them. The waitlists go
+    first so no one is promoted, then the reservations in chunks that give the
+    seats back, so the last transactions are short: each chunk of events is
+    deleted with what was written to them in the meantime. An interrupted run
+    leaves whole events behind, never rows referencing a deleted one.
+    """
+    events = queryset.values('pk')
+    delete_in_chunks(WaitlistEntry.objects.filter(event__in=events), chunk_size=chunk_size)
+    delete_reservations(Reservation.objects.filter(event__in=events), chunk_size)
+
+    def on_chunk(rows):
+        # rows of (id, date)
+        event_ids = [pk for pk, _ in rows]
+        delete_in_chunks(WaitlistEntry.objects.filter(event_id__in=event_ids), chunk_size=chunk_size)
+        delete_reservations(Reservation.objects.filter(event_id__in=event_ids), chunk_size)
+        delete_in_chunks(EventTag.objects.filter(event_id__in=event_ids), chunk_size=chunk_size)
+        backend = get_search_backend()
+        if backend is not None:
+            backend.remove_events(event_ids)
+        bump_events_version(*event_ids)
+        bump_calendar_months(*{date for _, date in rows})
+
+    return delete_in_chunks(queryset, ('pk', 'date'), on_chunk, chunk_size)
+
+
+def delete_user(user, chunk_size=None):
+    """
+    Deletes a user with their reservations, events and subscriptions. The
+    seats the user held on other users' events are given back. Every step
+    commits its chunks, after an interruption the deletion can be run again.
+    """
+    delete_in_chunks(WaitlistEntry.objects.filter(user=user), chunk_size=chunk_size)
+    # the user's events first, their waitlists would take the seats of the user's reservations on them
+    delete_events(Event.objects.filter(creator=user), chunk_size)
+    delete_reservations(Reservation.objects.filter(user=user), chunk_size)
+    delete_in_chunks(Subscription.objects.filter(user=user), chunk_size=chunk_size)
+    user_id = user.pk
+    # what's left (tokens, groups, permissions) is small and goes through the regular cascade
+    user.delete()
+    invalidate_reserved_event_ids(user_id)
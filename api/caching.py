@@ -0,0 +1,267 @@
+import hashlib
+import json
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import Signal
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Reservation
+
+
+def _reserved_event_ids_key(user_id):
+    return 'reserved_event_ids:{}'.format(user_id)
+
+
+def get_reserved_event_ids(user):
+    # ids of the events the user has a reservation for, one query per cache miss
+    key = _reserved_event_ids_key(user.pk)
+    event_ids = cache.get(key)
+    if event_ids is None:
+        event_ids = frozenset(Reservation.objects.filter(user=user).values_list('event_id', flat=True))
+        cache.set(key, event_ids, settings.RESERVED_EVENTS_CACHE_TIMEOUT)
+    return event_ids
+
+
+def invalidate_reserved_event_ids(*user_ids):
+    keys = [_reserved_event_ids_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    # a request reading in the meantime could cache the old set again, drop it once the writes are visible
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+# fields of a user kept in the authentication cache, the others are deferred
+AUTH_USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser')
+
+
+def _auth_user_version_key(user_id):
+    return 'auth_user_version:{}'.format(user_id)
+
+
+def get_auth_user(user_id):
+    """
+    Returns (cache key, cached AUTH_USER_FIELDS values of the user or None).
+    The key holds the user's current version, a lookup that raced with an
+    invalidation stores its stale values under a key nobody reads any more.
+    """
+    version = _get_version(_auth_user_version_key(user_id))
+    key = 'auth_user:{}:{!r}'.format(user_id, version)
+    return key, cache.get(key)
+
+
+def set_auth_user(key, values):
+    cache.set(key, values, settings.AUTH_USER_CACHE_TIMEOUT)
+
+
+def invalidate_auth_user(*user_ids):
+    # after a password change, logout, deactivation or deletion the user is read from the database again
+    def bump():
+        version = time.time()
+        cache.set_many({_auth_user_version_key(user_id): version for user_id in user_ids}, None)
+    bump()
+    transaction.on_commit(bump)
+
+
+def _event_version_key(event_id):
+    return 'event_version:{}'.format(event_id)
+
+
+# the event lists move with the writes of the listed fields, the seats and counters with _SEATS_VERSION_KEY
+_EVENTS_VERSION_KEY = 'events_version'
+_SEATS_VERSION_KEY = 'events_seats_version'
+
+
+def get_events_version(event_id=None):
+    """
+    Version of the event with the given id, or of the events table as a whole
+    when event_id is None. A version is the time of the last write, so it
+    doubles as the Last-Modified date of the responses built from it. The
+    version of the table doesn't move with the reservations, see
+    get_seats_version().
+    """
+    return _get_version(_EVENTS_VERSION_KEY if event_id is None else _event_version_key(event_id))
+
+
+def get_seats_version():
+    # version of the capacity_left and reservation_count of all the events, moved by the reservations
+    return _get_version(_SEATS_VERSION_KEY)
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        version = time.time()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+async def aget_events_version(event_id=None):
+    key = _EVENTS_VERSION_KEY if event_id is None else _event_version_key(event_id)
+    version = await cache.aget(key)
+    if version is None:
+        version = time.time()
+        if not await cache.aadd(key, version, None):
+            version = await cache.aget(key, version)
+    return version
+
+
+async def aget_seats_version():
+    version = await cache.aget(_SEATS_VERSION_KEY)
+    if version is None:
+        version = time.time()
+        if not await cache.aadd(_SEATS_VERSION_KEY, version, None):
+            version = await cache.aget(_SEATS_VERSION_KEY, version)
+    return version
+
+
+async def aget_event_versions(event_ids):
+    # {event id: version}, None for the events that weren't written since the cache was cleared
+    versions = await cache.aget_many([_event_version_key(event_id) for event_id in event_ids])
+    return {event_id: versions.get(_event_version_key(event_id)) for event_id in event_ids}
+
+
+# sent with the ids of the written events once the writes are committed, the live feed listens to it
+events_changed = Signal()
+
+
+def bump_events_version(*event_ids, listed=True):
+    """
+    Invalidates the cached responses of these events once the writes are
+    committed, and those of the event lists when listed. The reservations
+    only move the seats and counters (listed=False): the lists built before
+    show them for up to EVENT_LIST_SEATS_MAX_AGE more seconds, so a busy
+    event doesn't throw the cached lists away on every booking.
+    """
+    def bump():
+        now = time.time()
+        versions = {_event_version_key(event_id): now for event_id in event_ids}
+        versions[_EVENTS_VERSION_KEY if listed else _SEATS_VERSION_KEY] = now
+        cache.set_many(versions, None)
+        events_changed.send(sender=None, event_ids=event_ids)
+    transaction.on_commit(bump)
+
+
+def _response_key(request, version):
+    url = '{} {}'.format(request.build_absolute_uri(), request.META.get('HTTP_ACCEPT', ''))
+    return 'response:{!r}:{}'.format(version, hashlib.md5(url.encode()).hexdigest())
+
+
+def _cacheable(response, modified):
+    # (content, headers, etag, Last-Modified version) of a successful response, None for anything else
+    if callable(getattr(response, 'render', None)):
+        response.render()
+    if response.status_code != 200:
+        return None
+    etag = response.get('ETag') or quote_etag(hashlib.md5(response.content).hexdigest())
+    headers = [(name, value) for name, value in response.items() if name.lower() != 'set-cookie']
+    return response.content, headers, etag, modified
+
+
+def _modified(version, seats):
+    # the Last-Modified version of a response built now, the list responses also show the seats
+    return version if seats is None else max(version, seats)
+
+
+def _fresh(cached, seats):
+    # a list response built before the last reservation is served for EVENT_LIST_SEATS_MAX_AGE seconds more
+    return cached is not None and (
+        seats is None or seats <= cached[3] or time.time() - cached[3] < settings.EVENT_LIST_SEATS_MAX_AGE
+    )
+
+
+def event_etag(event, data):
+    """
+    ETag of the representation `data` of an event: the edit version of the
+    event, checked by the If-Match of the edits, and a hash of the data, which
+    also follows the seats and counters that the reservations change without
+    a new version.
+    """
+    digest = hashlib.md5(json.dumps(data, cls=JSONEncoder, sort_keys=True).encode()).hexdigest()
+    return quote_etag('{}-{}'.format(event.version, digest))
+
+
+def if_match_versions(request):
+    """
+    The event versions named by the If-Match header: None without the header
+    or with *, otherwise a set, empty when no tag is one of event_etag(). A
+    reservation in between doesn't fail an edit, only another edit does.
+    """
+    header = request.META.get('HTTP_IF_MATCH')
+    if header is None or header.strip() == '*':
+        return None
+    versions = set()
+    for etag in parse_etags(header):
+        version = etag.strip('"').partition('-')[0]
+        if version.isdigit():
+            versions.add(int(version))
+    return versions
+
+
+def _cached_response(request, cached, hit):
+    content, headers, etag, modified = cached
+    response = HttpResponse(content)
+    for name, value in headers:
+        response[name] = value
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(int(modified))
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return get_conditional_response(request, etag=etag, last_modified=int(modified), response=response)
+
+
+def cache_response(event_kwarg=None):
+    """
+    Caches the rendered 200 responses to GET requests of a view, keyed on the
+    full URL, the Accept header and the version of the event named by the
+    event_kwarg URL argument (of the whole events table without one, then the
+    seats version bounds how long the response is kept, see
+    bump_events_version()). Serves ETag and Last-Modified and answers
+    conditional requests with 304. Works on sync and async views.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view_func(request, *args, **kwargs)
+
+                version = await aget_events_version(kwargs[event_kwarg] if event_kwarg else None)
+                seats = None if event_kwarg else await aget_seats_version()
+                key = _response_key(request, version)
+                cached = await cache.aget(key)
+                hit = _fresh(cached, seats)
+                if not hit:
+                    response = await view_func(request, *args, **kwargs)
+                    cached = _cacheable(response, _modified(version, seats))
+                    if cached is None:
+                        return response
+                    await cache.aset(key, cached, settings.RESPONSE_CACHE_TIMEOUT)
+                return _cached_response(request, cached, hit)
+            return async_wrapper
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+
+            version = get_events_version(kwargs[event_kwarg] if event_kwarg else None)
+            seats = None if event_kwarg else get_seats_version()
+            key = _response_key(request, version)
+            cached = cache.get(key)
+            hit = _fresh(cached, seats)
+            if not hit:
+                response = view_func(request, *args, **kwargs)
+                cached = _cacheable(response, _modified(version, seats))
+                if cached is None:
+                    return response
+                cache.set(key, cached, settings.RESPONSE_CACHE_TIMEOUT)
+            return _cached_response(request, cached, hit)
+        return wrapper
+    return decorator
@@ -0,0 +1,119 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Event
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def last_day_of_month(day):
+    return _next_month(day) - datetime.timedelta(days=1)
+
+
+def _month_key(month, version):
+    return 'calendar:{!r}:{}'.format(version, month.strftime('%Y-%m'))
+
+
+def _month_version_key(month):
+    return 'calendar_version:{}'.format(month.strftime('%Y-%m'))
+
+
+def _get_month_versions(months):
+    # {month: version}, a month that wasn't written since the cache was cleared starts now
+    keys = {month: _month_version_key(month) for month in months}
+    versions = cache.get_many(keys.values())
+    missing = {key: time.time() for key in keys.values() if key not in versions}
+    for key, version in missing.items():
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+        versions[key] = version
+    return {month: versions[key] for month, key in keys.items()}
+
+
+def bump_calendar_months(*dates):
+    """
+    Invalidates the cached days of the months of these event dates, once the
+    writes are committed. The events_changed signal bumps the current month of
+    the written events (api/signals.py); pass the old date of a moved or
+    deleted event as well.
+    """
+    keys = {_month_version_key(_month_start(timezone.localdate(date))) for date in dates if date is not None}
+    if keys:
+        transaction.on_commit(lambda: cache.set_many(dict.fromkeys(keys, time.time()), None))
+
+
+def _count_days(first_month, end_month):
+    """
+    {month: [(day, events, capacity_left)]} for the months in [first_month,
+    end_month), with one grouped query over the date range. The range lookup
+    uses the (date, id) index, days are in the current time zone.
+    """
+    start = timezone.make_aware(datetime.datetime.combine(first_month, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(end_month, datetime.time.min))
+    rows = (
+        Event.objects.filter(date__gte=start, date__lt=end)
+        .annotate(day=TruncDate('date'))
+        .order_by()
+        .values('day')
+        .annotate(events=Count('id'), capacity_left=Sum('capacity_left'))
+        .values_list('day', 'events', 'capacity_left')
+        .order_by('day')
+    )
+    months = {}
+    month = first_month
+    while month < end_month:
+        months[month] = []
+        month = _next_month(month)
+    for day, events, capacity_left in rows:
+        months[_month_start(day)].append((day, events, capacity_left))
+    return months
+
+
+def calendar_days(first_day, last_day):
+    """
+    [(day, events, capacity_left)] of the days from first_day to last_day
+    (inclusive) that have events, in date order. The days are cached per
+    month under the version of the month, which only the writes to its
+    events move (bump_calendar_months()); the months missing from the cache
+    are counted with a single query.
+    """
+    months = []
+    month = _month_start(first_day)
+    while month <= last_day:
+        months.append(month)
+        month = _next_month(month)
+
+    versions = _get_month_versions(months)
+    keys = {month: _month_key(month, versions[month]) for month in months}
+    cached = cache.get_many(keys.values())
+    days = {month: cached[key] for month, key in keys.items() if key in cached}
+    missing = [month for month in months if month not in days]
+    if missing:
+        counted = _count_days(missing[0], _next_month(missing[-1]))
+        cache.set_many({keys[month]: counted[month] for month in missing}, settings.RESPONSE_CACHE_TIMEOUT)
+        days.update({month: counted[month] for month in missing})
+
+    return [row for month in months for row in days[month] if first_day <= row[0] <= last_day]
+
+
+def calendar_months(first_day, last_day):
+    # the days summed per month, [(first day of the month, events, capacity_left)]
+    months = {}
+    for day, events, capacity_left in calendar_days(first_day, last_day):
+        month = _month_start(day)
+        total_events, total_capacity_left = months.get(month, (0, 0))
+        months[month] = (total_events + events, total_capacity_left + capacity_left)
+    return [(month, events, capacity_left) for month, (events, capacity_left) in months.items()]
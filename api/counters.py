@@ -0,0 +1,73 @@
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .caching import bump_events_version
+from .models import Event, Reservation, UserProfile
+
+
+def _add_to_counts(model, deltas, **fields):
+    # one UPDATE per distinct delta, a chunk of deletes usually holds a single one
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        updates = {name: F(name) + delta * sign for name, sign in fields.items()}
+        model.objects.filter(pk__in=pks).update(**updates)
+
+
+def count_reservations(pairs, delta, seats=False):
+    """
+    Adds delta to the reservation_count of the user and of the event of every
+    (user_id, event_id) pair, one per created (delta=1) or deleted (delta=-1)
+    reservation. With seats, capacity_left moves the opposite way. Run it in
+    the transaction of the reservation writes so the counters commit with them.
+    """
+    pairs = list(pairs)
+    event_fields = {'reservation_count': 1, 'capacity_left': -1} if seats else {'reservation_count': 1}
+    _add_to_counts(Event, {pk: n * delta for pk, n in Counter(event for _, event in pairs).items()}, **event_fields)
+    _add_to_counts(UserProfile, {pk: n * delta for pk, n in Counter(user for user, _ in pairs).items()},
+                   reservation_count=1)
+
+
+def actual_reservation_count(field):
+    # COUNT(*) of the reservations of the outer row, field is 'event' or 'user'
+    reservations = Reservation.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+    return Coalesce(Subquery(reservations.annotate(n=Count('pk')).values('n')), Value(0))
+
+
+def drifted_events():
+    # ids of the events whose reservation_count or capacity_left doesn't match their reservations
+    actual = actual_reservation_count('event')
+    return Event.objects.annotate(actual=actual).exclude(
+        reservation_count=F('actual'), capacity_left=Greatest(F('capacity') - F('actual'), Value(0))
+    ).values_list('pk', flat=True)
+
+
+def drifted_users():
+    return UserProfile.objects.annotate(actual=actual_reservation_count('user')).exclude(
+        reservation_count=F('actual')
+    ).values_list('pk', flat=True)
+
+
+def repair_events(event_ids, chunk_size=None):
+    # recount in bulk, one UPDATE per chunk of ids
+    chunk_size = chunk_size or settings.BULK_DELETE_CHUNK_SIZE
+    for start in range(0, len(event_ids), chunk_size):
+        actual = actual_reservation_count('event')
+        Event.objects.filter(pk__in=event_ids[start:start + chunk_size]).update(
+            reservation_count=actual, capacity_left=Greatest(F('capacity') - actual, Value(0))
+        )
+    # cached event responses show capacity_left
+    bump_events_version(*event_ids, listed=False)
+
+
+def repair_users(user_ids, chunk_size=None):
+    chunk_size = chunk_size or settings.BULK_DELETE_CHUNK_SIZE
+    for start in range(0, len(user_ids), chunk_size):
+        UserProfile.objects.filter(pk__in=user_ids[start:start + chunk_size]).update(
+            reservation_count=actual_reservation_count('user')
+        )
@@ -0,0 +1,125 @@
+import csv
+import datetime
+import json
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+
+from .serializers import datetime_field
+
+# ?output= formats, 'format' is taken by DRF's content negotiation
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+# exported name -> values() lookup, the attendee's username and email are joined in
+RESERVATION_EXPORT_FIELDS = {
+    'id': 'id',
+    'created_at': 'created_at',
+    'event': 'event_id',
+    'user': 'user_id',
+    'username': 'user__username',
+    'email': 'user__email',
+}
+
+
+class _Echo:
+    # file-like object for csv.writer, hands each formatted line back instead of storing it
+    def write(self, value):
+        return value
+
+
+def parse_bound(value, end=False):
+    """
+    since/until query parameter: an ISO 8601 datetime or a date, naive values
+    are in the default time zone. A date is its first instant, or its last one
+    for an upper bound. Raises ValueError when the value is neither.
+    """
+    # parse_datetime also accepts a bare date, as midnight
+    day = parse_date(value)
+    if day is not None:
+        moment = datetime.datetime.combine(day, datetime.time.max if end else datetime.time.min)
+    else:
+        moment = parse_datetime(value)
+        if moment is None:
+            raise ValueError('Invalid date: {}'.format(value))
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filter_created_at(queryset, since=None, until=None):
+    # both bounds are inclusive, raises ValueError on an unparsable one
+    if since:
+        queryset = queryset.filter(created_at__gte=parse_bound(since))
+    if until:
+        queryset = queryset.filter(created_at__lte=parse_bound(until, end=True))
+    return queryset
+
+
+class _Formatter:
+    def __init__(self, fields, output):
+        self.names = list(fields)
+        self.lookups = list(fields.values())
+        self.output = output
+        self.created_at = datetime_field()
+        self.writer = csv.writer(_Echo())
+
+    def header(self):
+        return self.writer.writerow(self.names) if self.output == 'csv' else ''
+
+    def line(self, row):
+        row = [self.created_at(row[lookup]) if lookup == 'created_at' else row[lookup] for lookup in self.lookups]
+        if self.output == 'csv':
+            return self.writer.writerow(row)
+        return json.dumps(dict(zip(self.names, row)), separators=(',', ':'), ensure_ascii=False) + '\n'
+
+
+def _stream(rows, formatter, chunk_size):
+    # lines are sent in batches of chunk_size rows, memory stays bounded by one batch
+    batch = [formatter.header()]
+    for row in rows:
+        batch.append(formatter.line(row))
+        if len(batch) >= chunk_size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+async def _astream(rows, formatter, chunk_size):
+    batch = [formatter.header()]
+    async for row in rows:
+        batch.append(formatter.line(row))
+        if len(batch) >= chunk_size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def export_reservations(request, queryset, output, filename):
+    """
+    StreamingHttpResponse with the reservations of queryset, oldest first, one
+    NDJSON object or CSV line per reservation. Rows are read with a chunked
+    iterator, so memory doesn't grow with the number of reservations. Under
+    ASGI the rows are streamed by an async iterator, a sync one would be
+    consumed into memory by Django before sending.
+    """
+    chunk_size = settings.EXPORT_CHUNK_SIZE
+    # values() rather than values_list(), whose aiterator() runs the query on the event loop
+    queryset = queryset.order_by('created_at', 'id').values(*RESERVATION_EXPORT_FIELDS.values())
+    formatter = _Formatter(RESERVATION_EXPORT_FIELDS, output)
+
+    if isinstance(getattr(request, '_request', request), ASGIRequest):
+        content = _astream(queryset.aiterator(chunk_size=chunk_size), formatter, chunk_size)
+    else:
+        content = _stream(queryset.iterator(chunk_size=chunk_size), formatter, chunk_size)
+
+    response = StreamingHttpResponse(content, content_type=EXPORT_CONTENT_TYPES[output])
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename, output)
+    return response
@@ -0,0 +1,104 @@
+import math
+
+from django.db.models import Q
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+# precision stored on Event.geohash, 9 characters is a cell of roughly 5m x 5m
+GEOHASH_PRECISION = 9
+# mean earth radius (IUGG)
+EARTH_RADIUS_KM = 6371.0088
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    lat, lon = float(lat), float(lon)
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bit = 0
+    ch = 0
+    even = True
+    while len(geohash) < precision:
+        # bits alternate between longitude and latitude, longitude first
+        if even:
+            value, interval = lon, lon_range
+        else:
+            value, interval = lat, lat_range
+        mid = (interval[0] + interval[1]) / 2
+        if value >= mid:
+            ch = (ch << 1) | 1
+            interval[0] = mid
+        else:
+            ch = ch << 1
+            interval[1] = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            geohash.append(GEOHASH_ALPHABET[ch])
+            bit = 0
+            ch = 0
+    return ''.join(geohash)
+
+
+def geohash_cell_size(precision):
+    # (height, width) in degrees of a geohash cell of the given precision
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = math.floor(precision * 5 / 2)
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Returns (min_lat, max_lat, min_lon, max_lon) enclosing the circle of
+    radius_km around (lat, lon). The longitude span is None when the box
+    reaches a pole or crosses the antimeridian.
+    """
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = lat - delta_lat, lat + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90.0), min(max_lat, 90.0), None, None
+
+    delta_lon = math.degrees(math.asin(min(1.0, math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+    min_lon, max_lon = lon - delta_lon, lon + delta_lon
+    if min_lon < -180 or max_lon > 180:
+        return min_lat, max_lat, None, None
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def covering_geohashes(min_lat, max_lat, min_lon, max_lon, max_cells=16):
+    # the longest geohash prefixes whose cells cover the box using at most max_cells cells
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = geohash_cell_size(precision)
+        rows = range(int((min_lat + 90) // height), int((max_lat + 90) // height) + 1)
+        columns = range(int((min_lon + 180) // width), int((max_lon + 180) // width) + 1)
+        if len(rows) * len(columns) <= max_cells:
+            return sorted({
+                geohash_encode(-90 + (row + 0.5) * height, -180 + (column + 0.5) * width, precision)
+                for row in rows
+                for column in columns
+            })
+    return []
+
+
+def nearby_filter(lat, lon, radius_km):
+    """
+    Indexed prefilter for the events within radius_km of (lat, lon): a set of
+    geohash prefix ranges on Event.geohash plus a lat/lon range on the bounding
+    box. Candidates still need the exact haversine check.
+    """
+    min_lat, max_lat, min_lon, max_lon = bounding_box(lat, lon, radius_km)
+    condition = Q(lat__gte=min_lat, lat__lte=max_lat)
+    if min_lon is None:
+        return condition
+
+    cells = Q()
+    for prefix in covering_geohashes(min_lat, max_lat, min_lon, max_lon):
+        # a prefix match written as a range so it can use the index on every backend
+        cells |= Q(geohash__gte=prefix, geohash__lt=prefix + '{')
+    return cells & condition & Q(lon__gte=min_lon, lon__lte=max_lon)
@@ -0,0 +1,259 @@
+import asyncio
+import hashlib
+import re
+import threading
+import time
+import weakref
+from datetime import timedelta
+
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .models import GeocodeCacheEntry
+
+_session = None
+_session_lock = threading.Lock()
+
+# lookups of the same address currently waiting on the geocoder, keyed by cache key
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# the async client and in-flight lookups belong to the event loop they were created on
+_async_clients = weakref.WeakKeyDictionary()
+_async_inflight = weakref.WeakKeyDictionary()
+
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'coalesced': 0,
+    'upstream_requests': 0,
+    'upstream_errors': 0,
+    'upstream_seconds': 0.0,
+    'lookup_seconds': 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+def _count(name, value=1):
+    with _stats_lock:
+        _stats[name] += value
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
+
+
+def normalize_address(address):
+    # case, spacing and separators don't change the place an address points to
+    address = re.sub(r'\s*,\s*', ', ', ' '.join(address.casefold().split()))
+    return address.strip(', ')
+
+
+def get_session():
+    # one pooled session per process, connections to the geocoder are kept alive
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.GEOCODING_POOL_SIZE, max_retries=1)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def get_async_client():
+    # one pooled client per event loop, the async counterpart of get_session()
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        connect, read = settings.GEOCODING_TIMEOUT
+        client = _async_clients[loop] = httpx.AsyncClient(
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=settings.GEOCODING_POOL_SIZE,
+                                max_keepalive_connections=settings.GEOCODING_POOL_SIZE),
+            transport=httpx.AsyncHTTPTransport(retries=1),
+        )
+    return client
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _coalesce(key, fetch):
+    # the first caller fetches, concurrent callers for the same key wait for its result
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _inflight[key] = _Call()
+
+    if not leader:
+        _count('coalesced')
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = fetch()
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        call.done.set()
+
+
+async def _acoalesce(key, fetch):
+    # same as _coalesce, concurrent coroutines for the same key await the first one's future
+    inflight = _async_inflight.setdefault(asyncio.get_running_loop(), {})
+    future = inflight.get(key)
+    if future is not None:
+        _count('coalesced')
+        return await asyncio.shield(future)
+
+    future = inflight[key] = asyncio.get_running_loop().create_future()
+    try:
+        result = await fetch()
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        # retrieved here so an error nobody else waited for isn't logged as unhandled
+        future.exception()
+        raise
+    finally:
+        del inflight[key]
+
+
+def _upstream_headers():
+    return {
+        'Authorization': f'Bearer {settings.GEOCODING_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+
+
+def _request_upstream(address):
+    started = time.monotonic()
+    _count('upstream_requests')
+    try:
+        response = get_session().post(settings.GEOCODING_API_URL, headers=_upstream_headers(),
+                                      json={'address': address}, timeout=settings.GEOCODING_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+    except (requests.RequestException, ValueError):
+        _count('upstream_errors')
+        raise
+    finally:
+        _count('upstream_seconds', time.monotonic() - started)
+
+
+async def _arequest_upstream(address):
+    started = time.monotonic()
+    _count('upstream_requests')
+    try:
+        response = await get_async_client().post(settings.GEOCODING_API_URL, headers=_upstream_headers(),
+                                                 json={'address': address})
+        response.raise_for_status()
+        return response.json()
+    except (httpx.HTTPError, ValueError):
+        _count('upstream_errors')
+        raise
+    finally:
+        _count('upstream_seconds', time.monotonic() - started)
+
+
+def _store(key, address, data):
+    now = timezone.now()
+    GeocodeCacheEntry.objects.update_or_create(
+        key=key,
+        defaults={'address': address, 'response': data, 'created_at': now, 'last_used_at': now, 'hits': 0},
+    )
+    # least recently used entries beyond the size limit are evicted
+    excess = GeocodeCacheEntry.objects.count() - settings.GEOCODING_CACHE_MAX_ENTRIES
+    if excess > 0:
+        stale = GeocodeCacheEntry.objects.order_by('last_used_at').values_list('id', flat=True)[:excess]
+        GeocodeCacheEntry.objects.filter(id__in=list(stale)).delete()
+
+
+def _cache_key(address):
+    return hashlib.sha256(address.encode()).hexdigest()
+
+
+def _fresh_entries():
+    fresh_since = timezone.now() - timedelta(seconds=settings.GEOCODING_CACHE_TTL)
+    return GeocodeCacheEntry.objects.filter(created_at__gte=fresh_since).only('id', 'response')
+
+
+def geocode(address):
+    """
+    Returns the geocoder's JSON answer for address, from the database cache
+    when a fresh entry exists. Raises requests.RequestException (or
+    ValueError for an undecodable body) when the geocoder can't be reached.
+    """
+    started = time.monotonic()
+    address = normalize_address(address)
+    key = _cache_key(address)
+    try:
+        entry = _fresh_entries().filter(key=key).first()
+        if entry is not None:
+            _count('hits')
+            GeocodeCacheEntry.objects.filter(id=entry.id).update(last_used_at=timezone.now(), hits=F('hits') + 1)
+            return entry.response
+
+        _count('misses')
+
+        def fetch():
+            data = _request_upstream(address)
+            _store(key, address, data)
+            return data
+
+        return _coalesce(key, fetch)
+    finally:
+        _count('lookup_seconds', time.monotonic() - started)
+
+
+async def ageocode(address):
+    """
+    Async variant of geocode() for the async views: the cache is read with the
+    async ORM and the geocoder called with httpx, so no thread waits on the
+    round trip. Raises httpx.HTTPError (or ValueError) on upstream failures.
+    """
+    started = time.monotonic()
+    address = normalize_address(address)
+    key = _cache_key(address)
+    try:
+        entry = await _fresh_entries().filter(key=key).afirst()
+        if entry is not None:
+            _count('hits')
+            await GeocodeCacheEntry.objects.filter(id=entry.id).aupdate(last_used_at=timezone.now(),
+                                                                        hits=F('hits') + 1)
+            return entry.response
+
+        _count('misses')
+
+        async def fetch():
+            data = await _arequest_upstream(address)
+            await sync_to_async(_store)(key, address, data)
+            return data
+
+        return await _acoalesce(key, fetch)
+    finally:
+        _count('lookup_seconds', time.monotonic() - started)
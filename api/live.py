@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import json
+
+from django.conf import settings
+from django.utils.http import quote_etag
+
+from .caching import aget_event_versions
+from .models import Event
+
+
+def capacity_etag(capacity):
+    # ETag of the {event id: capacity_left} state of a subscription, for the conditional polls
+    state = json.dumps(sorted(capacity.items()), separators=(',', ':'))
+    return quote_etag(hashlib.md5(state.encode()).hexdigest())
+
+
+class Subscription:
+    """
+    The events followed by one client. The broker only signals `changed`;
+    the subscription diffs the broker's capacities against what it already
+    sent, so a slow client skips the intermediate values instead of queueing
+    them.
+    """
+
+    def __init__(self, broker, event_ids):
+        self.broker = broker
+        self.event_ids = event_ids
+        self.sent = {}
+        self.changed = asyncio.Event()
+
+    def capacity(self):
+        # {event id: capacity_left} of the existing events
+        return {event_id: self.broker.capacity[event_id]
+                for event_id in self.event_ids if event_id in self.broker.capacity}
+
+    def updates(self):
+        # [{event_id, capacity_left, delta}] since the last call, delta is None on the first one
+        self.changed.clear()
+        updates = []
+        for event_id, capacity_left in self.capacity().items():
+            sent = self.sent.get(event_id)
+            if sent != capacity_left:
+                self.sent[event_id] = capacity_left
+                updates.append({'event_id': event_id, 'capacity_left': capacity_left,
+                                'delta': None if sent is None else capacity_left - sent})
+        return updates
+
+    async def wait(self, timeout):
+        # True once one of the events changed, False after timeout seconds
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class CapacityBroker:
+    """
+    In-process fan-out of the capacity_left of the events followed by the
+    clients of the live feed. One task per process reads the followed events
+    with a single query and wakes the subscriptions whose events changed, so
+    any number of viewers of an event share one read.
+
+    The task reads the events written by this process as soon as the writes
+    are committed (notify(), called by the events_changed signal), the others
+    when their version in the cache moves, checked every LIVE_POLL_INTERVAL
+    seconds, and everything every LIVE_REFRESH_INTERVAL seconds for the caches
+    that aren't shared between processes.
+    """
+
+    def __init__(self):
+        self.loop = None
+
+    def _start(self, loop):
+        # state of the event loop of the process, a new loop (tests, reloads) starts over
+        self.loop = loop
+        self.subscriptions = {}
+        self.capacity = {}
+        self.versions = {}
+        self.pending = set()
+        # event id -> task of its first read, awaited by every subscriber arriving before it's done
+        self.first_reads = {}
+        self.wake = asyncio.Event()
+        self.task = None
+
+    async def subscribe(self, event_ids):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self._start(loop)
+        subscription = Subscription(self, event_ids)
+        new = [event_id for event_id in event_ids if event_id not in self.subscriptions]
+        for event_id in event_ids:
+            self.subscriptions.setdefault(event_id, set()).add(subscription)
+        if new:
+            # the first subscriber of an event reads it, the next ones get the broker's value
+            read = loop.create_task(self._first_read(new))
+            self.first_reads.update(dict.fromkeys(new, read))
+        reads = {self.first_reads[event_id] for event_id in event_ids if event_id in self.first_reads}
+        if reads:
+            try:
+                # asyncio.wait() doesn't cancel the shared reads when this subscriber goes away
+                await asyncio.wait(reads)
+                for read in reads:
+                    read.result()
+            except BaseException:
+                # failed or cancelled, the caller never gets the subscription to close
+                self.unsubscribe(subscription)
+                raise
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self._run())
+        return subscription
+
+    async def _first_read(self, event_ids):
+        try:
+            self.versions.update(await aget_event_versions(event_ids))
+            await self._read(event_ids)
+        finally:
+            for event_id in event_ids:
+                if self.first_reads.get(event_id) is asyncio.current_task():
+                    del self.first_reads[event_id]
+
+    def unsubscribe(self, subscription):
+        for event_id in subscription.event_ids:
+            subscribers = self.subscriptions.get(event_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscriptions[event_id]
+                    self.capacity.pop(event_id, None)
+                    self.versions.pop(event_id, None)
+
+    def notify(self, *event_ids):
+        # thread safe, the write paths run in worker threads under ASGI
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._notified, event_ids)
+        except RuntimeError:
+            # the loop was closed in the meantime
+            pass
+
+    def _notified(self, event_ids):
+        followed = self.subscriptions.keys() & set(event_ids)
+        if followed:
+            self.pending |= followed
+            self.wake.set()
+
+    async def _run(self):
+        refresh_at = self.loop.time() + settings.LIVE_REFRESH_INTERVAL
+        while self.subscriptions:
+            try:
+                await asyncio.wait_for(self.wake.wait(), settings.LIVE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wake.clear()
+
+            event_ids = list(self.subscriptions)
+            changed, self.pending = self.pending, set()
+            versions = await aget_event_versions(event_ids)
+            changed |= {event_id for event_id in event_ids if versions[event_id] != self.versions.get(event_id)}
+            if self.loop.time() >= refresh_at:
+                changed = set(event_ids)
+                refresh_at = self.loop.time() + settings.LIVE_REFRESH_INTERVAL
+            # the versions are read before the events, a write in between is read again on the next tick
+            self.versions.update(versions)
+            if changed:
+                await self._read(changed)
+
+    async def _read(self, event_ids):
+        rows = Event.objects.filter(pk__in=event_ids).values('id', 'capacity_left')
+        capacity = {row['id']: row['capacity_left'] async for row in rows}
+        for event_id in event_ids:
+            if event_id not in self.subscriptions or capacity.get(event_id) == self.capacity.get(event_id):
+                continue
+            if event_id in capacity:
+                self.capacity[event_id] = capacity[event_id]
+            else:
+                # deleted, the subscriptions stop reporting it
+                self.capacity.pop(event_id, None)
+            for subscription in self.subscriptions[event_id]:
+                subscription.changed.set()
+
+
+broker = CapacityBroker()
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.6 on 2026-10-16 23:53
+
+from django.db import migrations, models
+
+from api.geo import geohash_encode
+
+
+def populate_geohash(apps, schema_editor):
+    Event = apps.get_model('api', 'Event')
+    events = list(Event.objects.only('id', 'lat', 'lon'))
+    for event in events:
+        event.geohash = geohash_encode(event.lat, event.lon)
+    Event.objects.bulk_update(events, ['geohash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_event_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12),
+        ),
+        migrations.RunPython(populate_geohash, migrations.RunPython.noop),
+    ]
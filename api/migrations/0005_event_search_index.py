@@ -0,0 +1,50 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE api_event_fts USING fts5("
+            "name, description, location, tags, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        schema_editor.execute(
+            'INSERT INTO api_event_fts (rowid, name, description, location, tags) '
+            'SELECT id, name, description, location, tags FROM api_event'
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE TABLE api_event_search ('
+            'event_id bigint PRIMARY KEY REFERENCES api_event (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+            'document tsvector NOT NULL)'
+        )
+        schema_editor.execute('CREATE INDEX api_event_search_document_idx ON api_event_search USING GIN (document)')
+        schema_editor.execute(
+            "INSERT INTO api_event_search (event_id, document) "
+            "SELECT e.id, "
+            "setweight(to_tsvector('simple', coalesce(e.name, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(e.tags, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(e.location, '')), 'B') || "
+            "setweight(to_tsvector('simple', coalesce(e.description, '')), 'C') "
+            "FROM api_event e"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS api_event_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP TABLE IF EXISTS api_event_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_event_geohash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
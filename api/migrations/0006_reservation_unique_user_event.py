@@ -0,0 +1,35 @@
+# Generated by Django 5.0.6 on 2026-10-16 23:55
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def remove_duplicate_reservations(apps, schema_editor):
+    # keep the oldest reservation of every (user, event) pair and give the extra seats back
+    Event = apps.get_model('api', 'Event')
+    Reservation = apps.get_model('api', 'Reservation')
+    duplicates = (Reservation.objects.values('user_id', 'event_id')
+                  .annotate(first_id=Min('id'), total=Count('id'))
+                  .filter(total__gt=1))
+    for duplicate in duplicates:
+        Reservation.objects.filter(
+            user_id=duplicate['user_id'], event_id=duplicate['event_id']
+        ).exclude(id=duplicate['first_id']).delete()
+        Event.objects.filter(id=duplicate['event_id']).update(
+            capacity_left=F('capacity_left') + duplicate['total'] - 1
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_event_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_reservations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(fields=('user', 'event'), name='unique_reservation_per_user_event'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.6 on 2026-10-17 00:20
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def count_reservations(apps, schema_editor):
+    Event = apps.get_model('api', 'Event')
+    Reservation = apps.get_model('api', 'Reservation')
+    UserProfile = apps.get_model('api', 'UserProfile')
+
+    def actual(field):
+        reservations = Reservation.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+        return Coalesce(Subquery(reservations.annotate(n=Count('pk')).values('n')), Value(0))
+
+    Event.objects.update(reservation_count=actual('event'))
+    UserProfile.objects.update(reservation_count=actual('user'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='reservation_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='reservation_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_reservations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.1.15 on 2026-10-17 00:31
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def split_tags(apps, schema_editor):
+    # the free text tags of every event become rows of Tag and EventTag, as api.tags.parse_tags() splits them
+    Event = apps.get_model('api', 'Event')
+    Tag = apps.get_model('api', 'Tag')
+    EventTag = apps.get_model('api', 'EventTag')
+
+    names_by_event = {}
+    for event_id, text in Event.objects.exclude(tags='').values_list('id', 'tags').iterator():
+        names = (' '.join(name.split()).lower()[:50] for name in re.split(r'[,;#]', text))
+        names_by_event[event_id] = list(dict.fromkeys(name for name in names if name))
+
+    names = {name for event_names in names_by_event.values() for name in event_names}
+    Tag.objects.bulk_create([Tag(name=name) for name in sorted(names)], batch_size=1000)
+    tag_ids = dict(Tag.objects.values_list('name', 'id'))
+    EventTag.objects.bulk_create(
+        [EventTag(event_id=event_id, tag_id=tag_ids[name])
+         for event_id, event_names in names_by_event.items() for name in event_names],
+        batch_size=1000
+    )
+
+
+def join_tags(apps, schema_editor):
+    Event = apps.get_model('api', 'Event')
+    EventTag = apps.get_model('api', 'EventTag')
+
+    names_by_event = {}
+    for event_id, name in EventTag.objects.order_by('event_id', 'tag__name').values_list('event_id', 'tag__name'):
+        names_by_event.setdefault(event_id, []).append(name)
+    for event_id, names in names_by_event.items():
+        Event.objects.filter(pk=event_id).update(tags=', '.join(names)[:200])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_reservation_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='EventTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='event_tags', to='api.event')),
+                ('tag', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='event_tags', to='api.tag')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='eventtag',
+            index=models.Index(fields=['tag', 'event'], name='eventtag_tag_event_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='eventtag',
+            constraint=models.UniqueConstraint(fields=('event', 'tag'), name='unique_tag_per_event'),
+        ),
+        migrations.RunPython(split_tags, join_tags),
+        migrations.RemoveField(
+            model_name='event',
+            name='tags',
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='tags',
+            field=models.ManyToManyField(blank=True, related_name='events', through='api.EventTag', to='api.tag'),
+        ),
+    ]
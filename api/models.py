@@ -3,11 +3,14 @@ from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 
+from .geo import geohash_encode
+
 
 # Create your models here.
 
 class UserProfile(AbstractUser):
-    pass
+    # reservations held by the user, maintained with the reservations (api/counters.py)
+    reservation_count = models.IntegerField(default=0, editable=False)
 
 
 # class for Event
@@ -22,21 +25,78 @@ class Event(models.Model):
     capacity = models.IntegerField()
     capacity_left = models.IntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
-    tags = models.CharField(max_length=200, blank=True)
+    tags = models.ManyToManyField('Tag', through='EventTag', related_name='events', blank=True)
+    # geohash of (lat, lon), indexed for the nearby search
+    geohash = models.CharField(max_length=12, blank=True, editable=False, db_index=True)
+    # reservations of the event, maintained with the reservations (api/counters.py)
+    reservation_count = models.IntegerField(default=0, editable=False)
+    # tickets of the waitlist (api/waitlist.py): the next one to promote and the next one to hand out
+    waitlist_head = models.BigIntegerField(default=0, editable=False)
+    waitlist_tail = models.BigIntegerField(default=0, editable=False)
+    # incremented by every edit of the event, the reservations don't touch it; the If-Match of the edits
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    class Meta:
+        indexes = [
+            # upcoming events, date range (month) lists and keyset pagination on (date, id)
+            models.Index(fields=['date', 'id'], name='event_date_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.geohash = geohash_encode(self.lat, self.lon)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ({'lat', 'lon'} & set(update_fields)):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return (self.name + " by " + self.creator.username
                 + " at " + self.location + " on " + str(self.date))
 
 
+# normalized tag name (see api/tags.py), shared by the events tagged with it
+class Tag(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+    def __str__(self):
+        return self.name
+
+
+# couples an event with one of its tags
+class EventTag(models.Model):
+    # both foreign keys are the leading column of the constraint or of the index below
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='event_tags', db_index=False)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='event_tags', db_index=False)
+
+    class Meta:
+        constraints = [
+            # also the index of the tags of an event
+            models.UniqueConstraint(fields=['event', 'tag'], name='unique_tag_per_event'),
+        ]
+        indexes = [
+            # events of a tag, for the tag filters and the tag cloud
+            models.Index(fields=['tag', 'event'], name='eventtag_tag_event_idx'),
+        ]
+
+    def __str__(self):
+        return '{} #{}'.format(self.event_id, self.tag_id)
+
+
 # class for Subscription. A user have a subscription with
 # an amount of events that they can create and the amount left
 class Subscription(models.Model):
-    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    # the leading column of the (user, due_date) index below
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, db_index=False)
     max_amount = models.IntegerField()
     amount_left = models.IntegerField()
     due_date = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            # the active subscriptions of a user, taken by every event creation (api/subscriptions.py)
+            models.Index(fields=['user', 'due_date'], name='subscription_user_due_idx'),
+        ]
+
     def __str__(self):
         return self.user.username + " has " + str(self.amount_left) + " events left"
 
@@ -44,9 +104,54 @@ class Subscription(models.Model):
 # class for Reservation
 # couples a user with an event
 class Reservation(models.Model):
-    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
-    event = models.ForeignKey(Event, on_delete=models.CASCADE)
+    # both foreign keys are the leading column of a composite index below,
+    # a separate single column index would only slow down the writes
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, db_index=False)
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, db_index=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # a user can hold a single seat per event, also the index of the (user, event) lookups
+            models.UniqueConstraint(fields=['user', 'event'], name='unique_reservation_per_user_event'),
+        ]
+        indexes = [
+            # reservations of an event, in booking order
+            models.Index(fields=['event', 'created_at'], name='reservation_event_created_idx'),
+        ]
+
     def __str__(self):
         return self.user.username + " reserved " + self.event.name
+
+
+# a user waiting for a seat of a fully booked event, promoted in ticket order
+class WaitlistEntry(models.Model):
+    # both foreign keys are the leading column of a constraint below
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, db_index=False)
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, db_index=False)
+    ticket = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'event'], name='unique_waitlist_entry_per_user_event'),
+            # also the index of the queue of an event, in ticket order
+            models.UniqueConstraint(fields=['event', 'ticket'], name='unique_waitlist_ticket_per_event'),
+        ]
+
+    def __str__(self):
+        return '{} waits for {} (#{})'.format(self.user_id, self.event_id, self.ticket)
+
+
+# cached answer of the external geocoder for a normalized address
+class GeocodeCacheEntry(models.Model):
+    # sha256 of the normalized address
+    key = models.CharField(max_length=64, unique=True)
+    address = models.TextField()
+    response = models.JSONField()
+    created_at = models.DateTimeField()
+    last_used_at = models.DateTimeField(db_index=True)
+    hits = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.address
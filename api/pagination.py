@@ -0,0 +1,187 @@
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder truncates datetimes to milliseconds, the cursor needs the exact key
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    # opaque, url safe token holding the key of the last row of a page
+    payload = json.dumps(list(values), cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise NotFound('Invalid cursor')
+    if not isinstance(values, list):
+        raise NotFound('Invalid cursor')
+    return values
+
+
+def keyset_filter(ordering, position):
+    # (a, b) > (x, y)  <=>  a > x OR (a = x AND b > y)
+    # written out so every backend can use the index on the ordering columns
+    condition = Q()
+    for i, name in enumerate(ordering):
+        step = Q(**{name + '__gt': position[i]})
+        for previous, value in zip(ordering[:i], position[:i]):
+            step &= Q(**{previous: value})
+        condition |= step
+    return condition
+
+
+def query_params(request):
+    # DRF requests have query_params, the async views get a plain Django request
+    return getattr(request, 'query_params', request.GET)
+
+
+def get_page_size(request, default=None):
+    page_size = default or settings.API_PAGE_SIZE
+    try:
+        requested = int(query_params(request).get('page_size', page_size))
+    except (TypeError, ValueError):
+        requested = page_size
+    return max(1, min(requested, settings.API_MAX_PAGE_SIZE))
+
+
+def wants_unpaginated(request):
+    # explicit opt-in for clients that still expect the whole table as a plain list
+    return query_params(request).get('paginate', '').lower() in ('false', '0', 'no', 'off')
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on the ordering columns instead of using OFFSET.
+
+    The last column of `ordering` must be unique (the primary key) so the key of
+    every row is distinct and no row is skipped or repeated between pages.
+    """
+    ordering = ('id',)
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.get_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request):
+        queryset = self.get_page_queryset(queryset, request)
+        if queryset is None:
+            return None
+        return self.get_page([row async for row in queryset])
+
+    def get_page_queryset(self, queryset, request):
+        if wants_unpaginated(request):
+            return None
+
+        self.request = request
+        self.page_size = get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = query_params(request).get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(keyset_filter(self.ordering, self.decode_position(queryset.model, cursor)))
+
+        # fetch one extra row to know whether there is a next page
+        return queryset[:self.page_size + 1]
+
+    def get_page(self, rows):
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_position = self.get_position(rows[-1]) if self.has_next else None
+        return rows
+
+    def get_position(self, row):
+        if isinstance(row, dict):
+            return [row[name] for name in self.ordering]
+        return [getattr(row, name) for name in self.ordering]
+
+    def decode_position(self, model, cursor):
+        values = decode_cursor(cursor)
+        if len(values) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+        try:
+            return [model._meta.get_field(name).to_python(value) for name, value in zip(self.ordering, values)]
+        except ValidationError:
+            raise NotFound('Invalid cursor')
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class EventPagination(KeysetPagination):
+    ordering = ('date', 'id')
+
+
+class ReservationPagination(KeysetPagination):
+    ordering = ('created_at', 'id')
+
+
+class UserPagination(KeysetPagination):
+    ordering = ('id',)
+
+
+def paginate_sorted(rows, key, request, cursor_query_param='cursor'):
+    """
+    Keyset pagination of rows that are already in memory and sorted by key(row),
+    for orderings computed in Python. The key must end with a unique value.
+
+    Returns (page, next_link), page is None when the client opted out of pagination.
+    """
+    if wants_unpaginated(request):
+        return None, None
+
+    page_size = get_page_size(request)
+    cursor = query_params(request).get(cursor_query_param)
+    if cursor:
+        position = decode_cursor(cursor)
+        try:
+            rows = [row for row in rows if list(key(row)) > position]
+        except TypeError:
+            raise NotFound('Invalid cursor')
+
+    page = rows[:page_size]
+    next_link = None
+    if len(rows) > page_size:
+        next_link = replace_query_param(request.build_absolute_uri(), cursor_query_param,
+                                        encode_cursor(key(page[-1])))
+    return page, next_link
@@ -0,0 +1,152 @@
+import html
+import re
+from collections import namedtuple
+
+from django.db import connection
+
+# markers put around matched terms by the database, replaced by <mark> once the snippet is escaped
+_START, _STOP = '\x02', '\x03'
+
+SearchHit = namedtuple('SearchHit', ['event_id', 'rank', 'snippet'])
+
+
+def search_terms(keyword):
+    # multi-term queries are an AND of the words, every word also matches as a prefix
+    return re.findall(r'\w+', keyword.lower())
+
+
+def highlight(snippet):
+    return html.escape(snippet or '').replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+class SQLiteSearchBackend:
+    """
+    FTS5 virtual table api_event_fts (created by migration 0005) whose rowid
+    is the event id. Ranked with bm25, lower rank is a better match.
+    """
+    # bm25 weights of the name, description, location and tags columns
+    rank_sql = 'bm25(api_event_fts, 10.0, 1.0, 4.0, 6.0)'
+    # names of the tags of event e, space separated
+    tags_sql = (
+        "coalesce((SELECT group_concat(t.name, ' ') FROM api_eventtag et "
+        "JOIN api_tag t ON t.id = et.tag_id WHERE et.event_id = e.id), '')"
+    )
+
+    def index_event(self, event):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM api_event_fts WHERE rowid = %s', [event.pk])
+            cursor.execute(
+                'INSERT INTO api_event_fts (rowid, name, description, location, tags) '
+                'SELECT e.id, e.name, e.description, e.location, {tags} FROM api_event e '
+                'WHERE e.id = %s'.format(tags=self.tags_sql),
+                [event.pk]
+            )
+
+    def remove_events(self, event_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM api_event_fts WHERE rowid = %s', [[pk] for pk in event_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM api_event_fts')
+            cursor.execute(
+                'INSERT INTO api_event_fts (rowid, name, description, location, tags) '
+                'SELECT e.id, e.name, e.description, e.location, {tags} FROM api_event e'.format(tags=self.tags_sql)
+            )
+            cursor.execute("INSERT INTO api_event_fts (api_event_fts) VALUES ('optimize')")
+
+    def search(self, keyword, limit=None, after=None):
+        terms = search_terms(keyword)
+        if not terms:
+            return []
+
+        sql = (
+            "SELECT rowid, {rank}, snippet(api_event_fts, -1, '{start}', '{stop}', '…', 16) "
+            "FROM api_event_fts WHERE api_event_fts MATCH %s"
+        ).format(rank=self.rank_sql, start=_START, stop=_STOP)
+        params = [' '.join('"{}"*'.format(term) for term in terms)]
+        if after is not None:
+            sql += ' AND ({rank} > %s OR ({rank} = %s AND rowid > %s))'.format(rank=self.rank_sql)
+            params += [after[0], after[0], after[1]]
+        sql += ' ORDER BY 2, rowid'
+        if limit is not None:
+            sql += ' LIMIT %s'
+            params.append(limit)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [SearchHit(pk, rank, highlight(snippet)) for pk, rank, snippet in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    """
+    Weighted tsvector per event in api_event_search (created by migration 0005)
+    with a GIN index. Ranked with ts_rank_cd, negated so that, as with bm25,
+    lower rank is a better match.
+    """
+    document_sql = (
+        "setweight(to_tsvector('simple', coalesce(e.name, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce((SELECT string_agg(t.name, ' ') FROM api_eventtag et "
+        "JOIN api_tag t ON t.id = et.tag_id WHERE et.event_id = e.id), '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(e.location, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(e.description, '')), 'C')"
+    )
+    rank_sql = '-ts_rank_cd(s.document, q.query)'
+
+    def index_event(self, event):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO api_event_search (event_id, document) '
+                'SELECT e.id, {document} FROM api_event e WHERE e.id = %s '
+                'ON CONFLICT (event_id) DO UPDATE SET document = EXCLUDED.document'.format(document=self.document_sql),
+                [event.pk]
+            )
+
+    def remove_events(self, event_ids):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM api_event_search WHERE event_id = ANY(%s)', [list(event_ids)])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('TRUNCATE api_event_search')
+            cursor.execute(
+                'INSERT INTO api_event_search (event_id, document) '
+                'SELECT e.id, {document} FROM api_event e'.format(document=self.document_sql)
+            )
+
+    def search(self, keyword, limit=None, after=None):
+        terms = search_terms(keyword)
+        if not terms:
+            return []
+
+        sql = (
+            "SELECT s.event_id, {rank}, ts_headline('simple', e.name || ' ' || e.description, q.query, "
+            "'StartSel={start}, StopSel={stop}, MaxWords=24, MinWords=8') "
+            "FROM api_event_search s JOIN api_event e ON e.id = s.event_id, "
+            "to_tsquery('simple', %s) AS q(query) "
+            "WHERE s.document @@ q.query"
+        ).format(rank=self.rank_sql, start=_START, stop=_STOP)
+        params = [' & '.join('{}:*'.format(term) for term in terms)]
+        if after is not None:
+            sql += ' AND ({rank}, s.event_id) > (%s, %s)'.format(rank=self.rank_sql)
+            params += [after[0], after[1]]
+        sql += ' ORDER BY 2, s.event_id'
+        if limit is not None:
+            sql += ' LIMIT %s'
+            params.append(limit)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [SearchHit(pk, rank, highlight(snippet)) for pk, rank, snippet in cursor.fetchall()]
+
+
+_backends = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend():
+    # None on databases without a full-text index, callers fall back to icontains
+    backend = _backends.get(connection.vendor)
+    return backend() if backend else None
@@ -1,6 +1,13 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import F
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.exceptions import ParseError
 
 from .models import Event, Subscription, Reservation, UserProfile
+from .pagination import query_params
+from .tags import parse_tags, set_event_tags, tag_names_by_event
 from .models import UserProfile as User
 from django.contrib.auth import get_user_model, authenticate
 
@@ -23,15 +30,70 @@ class UserSerializer(serializers.ModelSerializer):
         )
         return user
 
-    class Meta:
-        model = User
-        fields = '__all__'
+
+class TagsField(serializers.Field):
+    # sorted tag names, written as a list of names or as a comma separated string
+    def to_representation(self, tags):
+        return sorted(tag.name for tag in tags.all())
+
+    def to_internal_value(self, data):
+        return parse_tags(data)
 
 
 class EventSerializer(serializers.ModelSerializer):
+    tags = TagsField(required=False)
+
     class Meta:
         model = Event
-        fields = '__all__'
+        # the waitlist tickets are internal, positions are read from events/<pk>/waitlist;
+        # the version is sent in the ETag of the detail responses
+        exclude = ('waitlist_head', 'waitlist_tail', 'version')
+
+    def create(self, validated_data):
+        tags = validated_data.pop('tags', None)
+        event = super().create(validated_data)
+        if tags:
+            set_event_tags(event, tags)
+        return event
+
+    def validate(self, data):
+        if self.instance is not None:
+            # the seats left follow the reservations, an edit changes the capacity instead; a client
+            # sending back the object it read may hold an older value, which is ignored
+            data.pop('capacity_left', None)
+            if data.get('capacity', self.instance.capacity) < self.instance.reservation_count:
+                raise serializers.ValidationError({'capacity': 'Lower than the {} reservations of the event.'.format(
+                    self.instance.reservation_count)})
+        return data
+
+    def update(self, instance, validated_data):
+        """
+        Writes only the columns whose value changed, with save(update_fields=...),
+        so an edit never writes back the seats or the counters it read. A new
+        capacity moves capacity_left by the difference in the database. Bumps
+        the version when anything changed.
+        """
+        tags = validated_data.pop('tags', None)
+        changed = []
+        for name, value in validated_data.items():
+            field = instance._meta.get_field(name)
+            if getattr(instance, field.attname) != (value.pk if field.is_relation else value):
+                changed.append(name)
+        old_capacity = instance.capacity
+        for name in changed:
+            setattr(instance, name, validated_data[name])
+        if 'capacity' in changed:
+            instance.capacity_left = F('capacity_left') + (instance.capacity - old_capacity)
+            changed.append('capacity_left')
+
+        tags_changed = tags is not None and set(tags) != set(instance.tags.values_list('name', flat=True))
+        if changed or tags_changed:
+            instance.version = F('version') + 1
+            instance.save(update_fields=changed + ['version'])
+            instance.refresh_from_db(fields=['version', 'capacity_left'])
+        if tags_changed:
+            set_event_tags(instance, tags)
+        return instance
 
 
 class SubscriptionSerializer(serializers.ModelSerializer):
@@ -44,3 +106,120 @@ class ReservationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reservation
         fields = '__all__'
+
+
+def datetime_field():
+    # DateTimeField's ISO 8601 output in the default time zone, UTC written as Z,
+    # without DRF looking up the active time zone for every value
+    tz = timezone.get_default_timezone()
+
+    def to_representation(value):
+        value = value.astimezone(tz).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return to_representation
+
+
+def decimal_field(decimal_places):
+    # DecimalField's output, a string with exactly decimal_places digits
+    exponent = Decimal(1).scaleb(-decimal_places)
+
+    def to_representation(value):
+        return '{:f}'.format(value.quantize(exponent, rounding=ROUND_HALF_UP))
+    return to_representation
+
+
+class CompactSerializer:
+    """
+    Read-only serializer for large lists. Rows are read with QuerySet.values()
+    and turned into dicts with the same representation as the ModelSerializer
+    of the model, without instantiating a model or binding fields per row.
+    Clients can ask for a subset of the fields with ?fields=name,date,...
+    """
+    # output name (and values() name) -> function converting the value, None when it's JSON ready as is
+    fields = {}
+    # output name -> function(ids) returning {id: value}, for the many-to-many fields values() can't
+    # read without a row per value; run once per list, the value of the ids missing from it is []
+    related = {}
+    fields_query_param = 'fields'
+
+    def __init__(self, request=None):
+        self.selected = tuple(self.fields)
+        requested = query_params(request).get(self.fields_query_param) if request is not None else None
+        if requested:
+            names = tuple(dict.fromkeys(name.strip() for name in requested.split(',') if name.strip()))
+            unknown = [name for name in names if name not in self.fields]
+            if unknown:
+                raise ParseError('Unknown fields: {}'.format(', '.join(unknown)))
+            if names:
+                self.selected = names
+
+    def values(self, queryset, extra=()):
+        # extra: columns needed on the rows without being shown, e.g. the pagination ordering
+        columns = tuple(name for name in self.selected if name not in self.related)
+        if len(columns) < len(self.selected):
+            columns += ('id',)
+        return queryset.values(*dict.fromkeys(columns + tuple(extra)))
+
+    def to_representation(self, rows):
+        related = [name for name in self.selected if name in self.related]
+        if related:
+            rows = list(rows)
+            ids = [row['id'] for row in rows]
+            for name in related:
+                values = self.related[name](ids)
+                for row in rows:
+                    row[name] = values.get(row['id'], [])
+        converters = [(name, self.fields[name]) for name in self.selected]
+        return [
+            {
+                name: row[name] if convert is None or row[name] is None else convert(row[name])
+                for name, convert in converters
+            }
+            for row in rows
+        ]
+
+    def serialize(self, queryset):
+        return self.to_representation(self.values(queryset))
+
+
+class EventCompactSerializer(CompactSerializer):
+    fields = {
+        'id': None,
+        # declared on EventSerializer, which puts it before the model fields
+        'tags': None,
+        'name': None,
+        'description': None,
+        'date': datetime_field(),
+        'location': None,
+        'lat': decimal_field(6),
+        'lon': decimal_field(6),
+        'capacity': None,
+        'capacity_left': None,
+        'created_at': datetime_field(),
+        'geohash': None,
+        'reservation_count': None,
+        'creator': None,
+    }
+    related = {
+        'tags': tag_names_by_event,
+    }
+
+
+class ReservationCompactSerializer(CompactSerializer):
+    fields = {
+        'id': None,
+        'created_at': datetime_field(),
+        'user': None,
+        'event': None,
+    }
+
+
+class UserCompactSerializer(CompactSerializer):
+    # the public profile, same fields as UserSerializer without the password
+    fields = {
+        'id': None,
+        'username': None,
+        'email': None,
+        'first_name': None,
+        'last_name': None,
+    }
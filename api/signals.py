@@ -0,0 +1,98 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import bump_events_version, events_changed, invalidate_auth_user, invalidate_reserved_event_ids
+from .calendar import bump_calendar_months
+from .counters import count_reservations
+from .live import broker
+from .models import Event, Reservation, UserProfile
+from .search import get_search_backend
+
+
+# keep the full-text index in sync with the events table
+@receiver(post_save, sender=Event)
+def index_event(sender, instance, **kwargs):
+    backend = get_search_backend()
+    if backend is not None:
+        backend.index_event(instance)
+
+
+# the tags are set after the event is saved, index it again with them
+@receiver(m2m_changed, sender=Event.tags.through)
+def reindex_tagged_event(sender, instance, action, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    # from a tag's side (tag.events), pk_set holds the events; the API never clears a tag's events
+    event_ids = (kwargs['pk_set'] or ()) if reverse else [instance.pk]
+    backend = get_search_backend()
+    if backend is not None:
+        for event_id in event_ids:
+            # the backends index the event from the database
+            backend.index_event(Event(pk=event_id))
+    bump_events_version(*event_ids)
+
+
+@receiver(post_delete, sender=Event)
+def unindex_event(sender, instance, **kwargs):
+    backend = get_search_backend()
+    if backend is not None:
+        backend.remove_events([instance.pk])
+
+
+# cached event responses show capacity_left, reservations change it too
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def invalidate_event_responses(sender, instance, **kwargs):
+    bump_events_version(instance.pk)
+
+
+@receiver(post_save, sender=Reservation)
+@receiver(post_delete, sender=Reservation)
+def invalidate_reserved_event_responses(sender, instance, **kwargs):
+    bump_events_version(instance.event_id, listed=False)
+
+
+# the cached ids of the user's reserved events, also for the generic endpoints and the admin.
+# bulk_create() and the chunked deletes (api/bulk.py) send no signals and invalidate them themselves
+@receiver(post_save, sender=Reservation)
+@receiver(post_delete, sender=Reservation)
+def invalidate_reserved_events(sender, instance, **kwargs):
+    invalidate_reserved_event_ids(instance.user_id)
+
+
+# the reservation counters of the event and of the user, in the transaction of the write.
+# bulk_create() and the chunked deletes (api/bulk.py) send no signals and count themselves
+@receiver(post_save, sender=Reservation)
+def count_created_reservation(sender, instance, created, **kwargs):
+    if created:
+        count_reservations([(instance.user_id, instance.event_id)], 1)
+
+
+@receiver(post_delete, sender=Reservation)
+def count_deleted_reservation(sender, instance, **kwargs):
+    count_reservations([(instance.user_id, instance.event_id)], -1)
+
+
+# the live capacity feed reads the written events again, every write path ends in bump_events_version()
+@receiver(events_changed)
+def publish_capacity(sender, event_ids, **kwargs):
+    broker.notify(*event_ids)
+
+
+# the calendar months of the written events, read once the writes are committed; the deleted
+# events are gone by then, their months are bumped with the deletion
+@receiver(events_changed)
+def invalidate_calendar_months(sender, event_ids, **kwargs):
+    bump_calendar_months(*Event.objects.filter(pk__in=event_ids).values_list('date', flat=True))
+
+
+@receiver(post_delete, sender=Event)
+def invalidate_deleted_event_month(sender, instance, **kwargs):
+    bump_calendar_months(instance.date)
+
+
+# the authentication cache (auth/authentication.py) holds the active flag and the profile fields
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_authenticated_user(sender, instance, **kwargs):
+    invalidate_auth_user(instance.pk)
@@ -0,0 +1,78 @@
+import datetime
+
+from django.conf import settings
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .models import Subscription, UserProfile
+
+
+def active_subscriptions(user, now=None):
+    # the user's subscriptions that aren't due yet, the one due first first, on the (user, due_date) index
+    now = now or timezone.now()
+    return Subscription.objects.filter(user=user, due_date__gt=now).order_by('due_date', 'pk')
+
+
+def take_quota(user):
+    """
+    Takes one event from the quota of the user's active subscriptions, the
+    one due first; a user who never had one gets the default subscription.
+    Returns None, or the error code: NO_ACTIVE_SUBSCRIPTION or QUOTA_EXCEEDED.
+    Run it in the transaction that creates the event, a failed creation gives
+    the event back with the rollback.
+
+    Each decrement is a conditional UPDATE that the database re-checks on the
+    locked row, so concurrent creations can't take the quota below zero; the
+    loser of the last unit moves on to the next subscription, if any.
+    """
+    now = timezone.now()
+    subscription_ids = list(active_subscriptions(user, now).filter(amount_left__gt=0).values_list('pk', flat=True))
+    for pk in subscription_ids:
+        if Subscription.objects.filter(pk=pk, due_date__gt=now, amount_left__gt=0).update(
+                amount_left=F('amount_left') - 1):
+            return None
+    if subscription_ids or active_subscriptions(user, now).exists():
+        return 'QUOTA_EXCEEDED'
+    if provide_default_subscription(user, now):
+        return take_quota(user)
+    return 'NO_ACTIVE_SUBSCRIPTION'
+
+
+def provide_default_subscription(user, now=None):
+    """
+    Gives a user who never had a subscription one of DEFAULT_EVENT_QUOTA events
+    per SUBSCRIPTION_PERIOD_DAYS, renewed by renew_expired() like the others.
+    Returns True when the user has an active subscription afterwards. The
+    user row is locked first, so concurrent calls create a single one. Run
+    it in a transaction.
+    """
+    if not settings.DEFAULT_EVENT_QUOTA:
+        return False
+    now = now or timezone.now()
+    # FOR NO KEY UPDATE: the rows inserted with a key to the user don't wait on it
+    list(UserProfile.objects.select_for_update(no_key=True).filter(pk=user.pk).values_list('pk'))
+    if not Subscription.objects.filter(user=user).exists():
+        Subscription.objects.create(user=user, max_amount=settings.DEFAULT_EVENT_QUOTA,
+                                    amount_left=settings.DEFAULT_EVENT_QUOTA,
+                                    due_date=now + datetime.timedelta(days=settings.SUBSCRIPTION_PERIOD_DAYS))
+        return True
+    # created by a concurrent call
+    return active_subscriptions(user, now).exists()
+
+
+def renew_expired(now=None):
+    """
+    Refills the quota of every subscription that is due, with a single UPDATE,
+    and moves its due date one SUBSCRIPTION_PERIOD_DAYS forward, or a period
+    from now for the ones that lapsed for longer. Returns the number of
+    renewed subscriptions.
+    """
+    now = now or timezone.now()
+    period = datetime.timedelta(days=settings.SUBSCRIPTION_PERIOD_DAYS)
+    return Subscription.objects.filter(due_date__lte=now).update(
+        amount_left=F('max_amount'),
+        due_date=Case(
+            When(due_date__gt=now - period, then=F('due_date') + period),
+            default=Value(now + period),
+        ),
+    )
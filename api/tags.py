@@ -0,0 +1,92 @@
+import re
+
+from django.conf import settings
+from django.db.models import Count
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from .models import EventTag, Tag
+from .pagination import query_params
+
+TAG_MAX_LENGTH = Tag._meta.get_field('name').max_length
+
+# ?tag_mode= of the tag filter: events with every tag, or with any of them
+TAG_MODES = ('and', 'or')
+
+
+def normalize_tag(name):
+    # lower case, single spaces, no leading #
+    return ' '.join(name.replace('#', ' ').split()).lower()
+
+
+def parse_tags(value):
+    """
+    Tag names of an event, given as a list of names or as the former free text
+    field: names separated by commas, semicolons or #. Returns the normalized
+    names without duplicates, in the given order. Raises ValidationError.
+    """
+    if isinstance(value, str):
+        value = [value]
+    elif not isinstance(value, (list, tuple)) or not all(isinstance(name, str) for name in value):
+        raise ValidationError('Tags must be a list of names or a comma separated string.')
+
+    names = (normalize_tag(name) for text in value for name in re.split(r'[,;#]', text))
+    names = list(dict.fromkeys(name for name in names if name))
+    too_long = [name for name in names if len(name) > TAG_MAX_LENGTH]
+    if too_long:
+        raise ValidationError('Tags are at most {} characters long: {}'.format(TAG_MAX_LENGTH, ', '.join(too_long)))
+    if len(names) > settings.EVENT_MAX_TAGS:
+        raise ValidationError('At most {} tags per event.'.format(settings.EVENT_MAX_TAGS))
+    return names
+
+
+def get_tags(names):
+    # the Tag rows of names, the missing ones are created
+    tags = list(Tag.objects.filter(name__in=names))
+    missing = set(names) - {tag.name for tag in tags}
+    if missing:
+        # a concurrent request may create the same names, they are read back below
+        Tag.objects.bulk_create([Tag(name=name) for name in missing], ignore_conflicts=True)
+        tags += Tag.objects.filter(name__in=missing)
+    return tags
+
+
+def set_event_tags(event, names):
+    # replaces the tags of the event, the m2m_changed receivers reindex it (api/signals.py)
+    event.tags.set(get_tags(names))
+
+
+def tag_names_by_event(event_ids):
+    # {event id: sorted tag names} with one query, for a page of events
+    names = {}
+    rows = EventTag.objects.filter(event_id__in=event_ids).order_by('tag__name').values_list('event_id', 'tag__name')
+    for event_id, name in rows:
+        names.setdefault(event_id, []).append(name)
+    return names
+
+
+def filter_by_tags(queryset, request):
+    """
+    Events of queryset tagged with every ?tag= (tag_mode=and, the default) or
+    with any of them (tag_mode=or). Runs as a subquery on the (tag, event)
+    index of EventTag, raises ValidationError on an unknown mode.
+    """
+    params = query_params(request)
+    names = list(dict.fromkeys(name for name in map(normalize_tag, params.getlist('tag')) if name))
+    mode = params.get('tag_mode', 'and')
+    if mode not in TAG_MODES:
+        raise ValidationError({'tag_mode': 'Must be one of: {}'.format(', '.join(TAG_MODES))})
+    if not names:
+        return queryset
+
+    tagged = EventTag.objects.filter(tag__name__in=names).order_by().values('event_id')
+    if mode == 'and' and len(names) > 1:
+        # one EventTag row per matched tag, the unique constraint rules out duplicates
+        tagged = tagged.annotate(matched=Count('id')).filter(matched=len(names))
+    return queryset.filter(id__in=tagged.values('event_id'))
+
+
+class TagFilterBackend(BaseFilterBackend):
+    # ?tag=a&tag=b&tag_mode=and|or on the event lists
+    def filter_queryset(self, request, queryset, view):
+        return filter_by_tags(queryset, request)
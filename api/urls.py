@@ -1,23 +1,34 @@
+from django.conf import settings
 from django.urls import path
 
 import api.views
 import auth.views
-from . import views
+from . import async_views, views
+
+# views with an async variant, picked when the API is served by the ASGI application
+io_views = async_views if settings.ASYNC_VIEWS else views
 
 urlpatterns = [
     # Events
-    path('events/', views.EventListRetrieveView.as_view(), name='events'),
-    path('events/upcoming', views.UpcomingEventsView.as_view(), name='events'),
+    path('events/', io_views.EventListRetrieveView.as_view(), name='events'),
+    path('events/upcoming', io_views.UpcomingEventsView.as_view(), name='events'),
     path('events/new', views.CreateEventView.as_view(), name='events'),
-    path('events/<int:pk>/', views.EventRetrieveViewDestroy.as_view(), name='event'),
+    path('events/<int:pk>/', io_views.EventRetrieveViewDestroy.as_view(), name='event'),
     path('events/month/<int:pk>/', views.EventListRetrieveViewGivenMonth.as_view(), name='events_month'),
+    path('events/live', io_views.EventCapacityView.as_view(), name='events_live'),
+    path('events/calendar', views.EventCalendarView.as_view(), name='events_calendar'),
+    path('tags/cloud', views.TagCloudView.as_view(), name='tag_cloud'),
     path('events/search', views.EventSearchView.as_view(), name='event-search'),
+    path('events/nearby', views.EventNearbyView.as_view(), name='events-nearby'),
     path('events/<int:pk>/reservations/', views.ReservationListRetrieveViewGivenEvent.as_view(),
          name='event_reservation'),
+    path('events/<int:pk>/reservations/export', views.EventReservationsExportView.as_view(),
+         name='event_reservations_export'),
     path('events/<int:pk>/reservations/<str:username>/', views.ReservationCreateDeleteViewGivenUser.as_view(),
          name='event_reservations'),
+    path('events/<int:pk>/waitlist', views.EventWaitlistView.as_view(), name='event_waitlist'),
     path('events/<int:pk>/attendees/', views.EventRetrieveAttendeesGivenEvent.as_view(), name='event_reservations'),
-    path('events/<int:event_id>/creator-info/', views.EventCreatorInfoView.as_view(), name='event-creator-info'),
+    path('events/<int:event_id>/creator-info/', io_views.EventCreatorInfoView.as_view(), name='event-creator-info'),
     # Users
     path('users/profile/', auth.views.UserView.as_view(), name='user'),  # protected route
     path('users/number-of-reservations/', views.UserReservationCountView.as_view(), name='user_reservations_count'),
@@ -31,14 +42,19 @@ urlpatterns = [
 
     # Reservations
     path('reservations/', views.ReservationListRetrieveView.as_view(), name='reservations'),
+    path('reservations/export', views.ReservationsExportView.as_view(), name='reservations_export'),
     path('reservations/<int:pk>/', views.ReservationListRetrieveViewGivenEvent.as_view(), name='reservation'),
 
     path('reservations/<int:pk>/is_reserved', views.IsEventReservedView.as_view(), name='reservation'),
+    path('reservations/is_reserved', views.AreEventsReservedView.as_view(), name='reservations_is_reserved'),
 
     path('reservations/<int:pk>/remove', views.RemoveReservationView.as_view(), name='delete_reservation'),
 
     path('reservations/new', views.CreateReservationView.as_view(), name='create_reservation'),
 
+    path('reservations/batch', views.BatchReservationView.as_view(), name='batch_reservations'),
+
     # Geocode
-    path('geocode/', views.GeocodeView.as_view(), name='geocode'),
+    path('geocode/', io_views.GeocodeView.as_view(), name='geocode'),
+    path('geocode/stats', views.GeocodeStatsView.as_view(), name='geocode_stats'),
 ]
@@ -1,39 +1,75 @@
+import datetime
 import os
 import requests
 
 import bcrypt
-from django.db.models import Q
+from django.db.models import Count, F, Q
+from django.http import Http404
 from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.decorators import method_decorator
 from django.utils import timezone
 from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from django.contrib.auth import login, logout
 from rest_framework.views import APIView
 from rest_framework.authentication import SessionAuthentication
 from django.db import IntegrityError, transaction
-from rest_framework_simplejwt.authentication import JWTAuthentication
 
-from .models import Event, Reservation, UserProfile as User
-from .serializers import EventSerializer, UserSerializer, ReservationSerializer
+from .models import Event, GeocodeCacheEntry, Reservation, Tag, UserProfile as User, WaitlistEntry
+from .geocoding import geocode, get_stats
+from .bulk import delete_events, delete_reservations, delete_user
+from .calendar import bump_calendar_months, calendar_days, calendar_months, last_day_of_month
+from .exports import EXPORT_CONTENT_TYPES, export_reservations, filter_created_at
+from .caching import (bump_events_version, cache_response, event_etag, get_reserved_event_ids, if_match_versions,
+                      invalidate_reserved_event_ids)
+from .geo import haversine_km, nearby_filter
+from .live import capacity_etag
+from .pagination import (EventPagination, ReservationPagination, UserPagination, decode_cursor, encode_cursor,
+                         get_page_size, paginate_sorted, wants_unpaginated)
+from .search import get_search_backend
+from .subscriptions import take_quota
+from .tags import TagFilterBackend, normalize_tag
+from .waitlist import WaitlistError, join_waitlist, promote_waiting, waitlist_position
+from .serializers import (EventCompactSerializer, EventSerializer, ReservationCompactSerializer,
+                          ReservationSerializer, UserCompactSerializer, UserSerializer)
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from dotenv import load_dotenv
 
+from auth.authentication import CachedJWTAuthentication
 from auth.validations import registration_validation, validate_password, validate_email
 
 load_dotenv()
 
 
+class CompactListMixin:
+    # list() of a generic view read with a compact serializer (api/serializers.py), ?fields= selects the fields
+    compact_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.compact_serializer_class(request)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(serializer.values(queryset, getattr(self.paginator, 'ordering', ())))
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.serialize(queryset))
+
+
 # Class to view all users
-class UserListView(generics.ListCreateAPIView):
+class UserListView(CompactListMixin, generics.ListCreateAPIView):
     # only admin has access
     permission_classes = (permissions.IsAdminUser,)
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    compact_serializer_class = UserCompactSerializer
+    pagination_class = UserPagination
 
 
 # Class to create a new user
@@ -60,7 +96,8 @@ class UserRetrieveDestroyView(generics.ListCreateAPIView):
     def delete(self, request, *args, **kwargs):
         try:
             user = self.queryset.get(pk=kwargs["pk"])
-            user.delete()
+            # commits chunk by chunk, see api/bulk.py
+            delete_user(user)
             return Response(status=status.HTTP_204_NO_CONTENT)
         except User.DoesNotExist:
             return Response(
@@ -72,40 +109,39 @@ class UserRetrieveDestroyView(generics.ListCreateAPIView):
 
 
 class DeleteUserAccountView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
-    @transaction.atomic
     def delete(self, request):
         user = request.user
         try:
-            # Delete all reservations made by the user
-            Reservation.objects.filter(user=user).delete()
-
-            # Delete all events created by the user
-            Event.objects.filter(creator=user).delete()
-
-            # Finally, delete the user account
-            user.delete()
+            # Delete the reservations made by the user, the events created by
+            # the user and finally the user account, with set-based deletes
+            # committed chunk by chunk; after an error a new request finishes it
+            delete_user(user)
 
             return Response({
                 "message": "User account and all associated data have been successfully deleted."
             }, status=status.HTTP_200_OK)
 
         except Exception as e:
-            # If any error occurs, rollback the transaction
-            transaction.set_rollback(True)
             return Response({
                 "error": f"An error occurred while deleting the account: {str(e)}",
                 "code": "DELETE_ACCOUNT_ERROR"
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@method_decorator(cache_response(event_kwarg='event_id'), name='dispatch')
 class EventCreatorInfoView(APIView):
     def get(self, request, event_id):
         try:
-            # Get the event by ID
-            event = get_object_or_404(Event, id=event_id)
+            # Get the event by ID, joined with its creator
+            event = get_object_or_404(
+                Event.objects.select_related('creator').only(
+                    'creator__username', 'creator__first_name', 'creator__last_name'
+                ),
+                id=event_id
+            )
 
             # Get the creator of the event
             creator = event.creator
@@ -119,7 +155,7 @@ class EventCreatorInfoView(APIView):
 
             return Response(creator_info, status=status.HTTP_200_OK)
 
-        except Event.DoesNotExist:
+        except (Event.DoesNotExist, Http404):
             return Response({
                 'error': 'Event not found',
                 'code': 'EVENT_NOT_FOUND'
@@ -133,15 +169,16 @@ class EventCreatorInfoView(APIView):
 
 
 class IsEventReservedView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
-        # Get the event or return 404 if not found
-        event = get_object_or_404(Event, pk=pk)
-
         # Check if the user has a reservation for this event
-        is_reserved = Reservation.objects.filter(user=request.user, event=event).exists()
+        is_reserved = pk in get_reserved_event_ids(request.user)
+
+        # Return 404 if the event doesn't exist
+        if not is_reserved and not Event.objects.filter(pk=pk).exists():
+            raise Http404('No Event matches the given query.')
 
         return Response({
             'event_id': pk,
@@ -149,8 +186,34 @@ class IsEventReservedView(APIView):
         }, status=status.HTTP_200_OK)
 
 
+# Reservation status of a list of events, ?ids=1,2,3
+class AreEventsReservedView(APIView):
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        try:
+            event_ids = [int(event_id) for event_id in request.query_params.get('ids', '').split(',') if event_id]
+        except ValueError:
+            return Response({'error': 'Event IDs must be integers', 'code': 'INVALID_EVENT_ID'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not event_ids:
+            return Response({'error': 'A list of event IDs is required', 'code': 'MISSING_EVENT_IDS'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(event_ids) > settings.RESERVATION_BATCH_MAX_SIZE:
+            return Response({
+                'error': 'At most {} events per request'.format(settings.RESERVATION_BATCH_MAX_SIZE),
+                'code': 'BATCH_TOO_LARGE'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        reserved = get_reserved_event_ids(request.user)
+        return Response({
+            'results': [{'event_id': event_id, 'is_reserved': event_id in reserved} for event_id in event_ids]
+        }, status=status.HTTP_200_OK)
+
+
 class RemoveReservationView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request, pk):
@@ -158,36 +221,39 @@ class RemoveReservationView(APIView):
             with transaction.atomic():
                 # Get the event or raise ObjectDoesNotExist
                 try:
-                    event = Event.objects.get(pk=pk)
+                    event = Event.objects.only('id', 'date').get(pk=pk)
                 except Event.DoesNotExist:
                     return Response({
                         'error': 'Event not found',
                         'code': 'EVENT_NOT_FOUND'
                     }, status=status.HTTP_404_NOT_FOUND)
 
-                # Try to get the reservation
-                try:
-                    reservation = Reservation.objects.get(user=request.user, event=event)
-                except Reservation.DoesNotExist:
-                    return Response({
-                        'error': 'No reservation found for this event',
-                        'code': 'RESERVATION_NOT_FOUND'
-                    }, status=status.HTTP_404_NOT_FOUND)
+                reservations = Reservation.objects.filter(user=request.user, event_id=pk)
 
                 # Check if the event has already occurred
-                from django.utils import timezone
                 if event.date < timezone.now():
+                    if not reservations.exists():
+                        return Response({
+                            'error': 'No reservation found for this event',
+                            'code': 'RESERVATION_NOT_FOUND'
+                        }, status=status.HTTP_404_NOT_FOUND)
                     return Response({
                         'error': 'Cannot remove reservation for past events',
                         'code': 'PAST_EVENT'
                     }, status=status.HTTP_400_BAD_REQUEST)
 
-                # Reservation exists and event is in the future, delete it
-                reservation.delete()
+                # Event is in the future, delete the reservation if there is one
+                deleted, _ = reservations.delete()
+                if not deleted:
+                    return Response({
+                        'error': 'No reservation found for this event',
+                        'code': 'RESERVATION_NOT_FOUND'
+                    }, status=status.HTTP_404_NOT_FOUND)
 
-                # Increase the event's capacity_left
-                event.capacity_left += 1
-                event.save()
+                # Give the seat back in the database, not from the value read above,
+                # the first user of the waitlist takes it in this transaction
+                Event.objects.filter(pk=pk).update(capacity_left=F('capacity_left') + 1)
+                promote_waiting([pk])
 
                 return Response({
                     'message': 'Reservation successfully removed',
@@ -209,7 +275,7 @@ class UserReservationsListRetrieveView(generics.ListCreateAPIView):
     def get(self, request, *args, **kwargs):
         try:
             reservations = Reservation.objects.filter(user_id=kwargs["pk"])
-            return Response(ReservationSerializer(reservations, many=True).data)
+            return Response(ReservationCompactSerializer(request).serialize(reservations))
         except Reservation.DoesNotExist:
             return Response(
                 data={
@@ -220,21 +286,21 @@ class UserReservationsListRetrieveView(generics.ListCreateAPIView):
 
 
 class UserReservedEventsListView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
+        # an unknown ?fields= is a 400, not an error retrieving the reservations
+        serializer = EventCompactSerializer(request)
         try:
-            # Get reservations for the authenticated user
-            reservations = Reservation.objects.filter(user=request.user)
-
-            # Get events associated with these reservations, ordered by date
+            # Get the events the authenticated user has reserved, ordered by date,
+            # the reservations are matched by a subquery in the same statement
             events = Event.objects.filter(
-                id__in=[reservation.event_id for reservation in reservations]
-            ).order_by('date')  # This line orders the events by date
+                id__in=Reservation.objects.filter(user=request.user).values('event_id')
+            ).order_by('date')
 
             # Serialize and return the events
-            return Response(EventSerializer(events, many=True).data)
+            return Response(serializer.serialize(events))
         except Exception as e:
             return Response(
                 data={
@@ -244,40 +310,57 @@ class UserReservedEventsListView(APIView):
             )
 
 
-# Class to view all events
-class EventListRetrieveView(generics.ListCreateAPIView):
-    queryset = Event.objects.all()
-    serializer_class = EventSerializer
+class EventCreateMixin:
+    # POST of a new event by the authenticated user, taken from the quota of their subscriptions
+    errors = {
+        'NO_ACTIVE_SUBSCRIPTION': 'An active subscription is required to create events',
+        'QUOTA_EXCEEDED': 'No events left in your subscription until it renews',
+    }
 
     def post(self, request, *args, **kwargs):
+        # if not request.user.has_perm('your_app.add_event'):
+        #     raise PermissionDenied("You don't have permission to create events.")
+
         serializer = EventSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            # the event is taken from the creator's quota in the transaction that creates it
+            with transaction.atomic():
+                code = take_quota(request.user)
+                if code is not None:
+                    return Response({'error': self.errors[code], 'code': code}, status=status.HTTP_403_FORBIDDEN)
+                # Add the current user as the creator of the event
+                serializer.save(creator=request.user)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class UpcomingEventsView(generics.ListAPIView):
+# Class to view all events
+@method_decorator(cache_response(), name='dispatch')
+class EventListRetrieveView(EventCreateMixin, CompactListMixin, generics.ListCreateAPIView):
+    # anyone can read the events, creating one is the same as events/new
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    queryset = Event.objects.all()
     serializer_class = EventSerializer
+    compact_serializer_class = EventCompactSerializer
+    pagination_class = EventPagination
+    filter_backends = [TagFilterBackend]
+
+
+@method_decorator(cache_response(), name='dispatch')
+class UpcomingEventsView(EventCreateMixin, CompactListMixin, generics.ListAPIView):
+    # anyone can read the events, creating one is the same as events/new
+    permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    serializer_class = EventSerializer
+    compact_serializer_class = EventCompactSerializer
+    pagination_class = EventPagination
+    filter_backends = [TagFilterBackend]
 
     def get_queryset(self):
         # Get current date and time
         now = timezone.now()
 
         # Filter events that are happening now or in the future
-        return Event.objects.filter(date__gte=now).order_by('date')
-
-    def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
-
-    def post(self, request, *args, **kwargs):
-        serializer = EventSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        return Event.objects.filter(date__gte=now).order_by('date', 'id')
 
 
 class EventSearchView(APIView):
@@ -286,15 +369,107 @@ class EventSearchView(APIView):
         if not keyword:
             return Response({"error": "Please provide a search keyword"}, status=status.HTTP_400_BAD_REQUEST)
 
-        events = Event.objects.filter(
-            Q(name__icontains=keyword) |
-            Q(description__icontains=keyword) |
-            Q(location__icontains=keyword) |
-            Q(tags__icontains=keyword)
-        ).distinct()
+        serializer = EventCompactSerializer(request)
+        backend = get_search_backend()
+        if backend is None:
+            # no full-text index on this database, plain substring match
+            events = Event.objects.filter(
+                Q(name__icontains=keyword) |
+                Q(description__icontains=keyword) |
+                Q(location__icontains=keyword) |
+                Q(tags__name=normalize_tag(keyword))
+            ).distinct()
+
+            paginator = EventPagination()
+            page = paginator.paginate_queryset(serializer.values(events, paginator.ordering), request, view=self)
+            if page is None:
+                return Response(serializer.serialize(events))
+            return paginator.get_paginated_response(serializer.to_representation(page))
+
+        # ranked results, best match first, paginated on (rank, id)
+        unpaginated = wants_unpaginated(request)
+        if unpaginated:
+            hits = backend.search(keyword)
+        else:
+            cursor = request.query_params.get('cursor')
+            after = decode_cursor(cursor) if cursor else None
+            if after is not None and len(after) != 2:
+                raise NotFound('Invalid cursor')
+            page_size = get_page_size(request)
+            hits = backend.search(keyword, limit=page_size + 1, after=after)
+
+        next_link = None
+        if not unpaginated and len(hits) > page_size:
+            hits = hits[:page_size]
+            next_link = replace_query_param(request.build_absolute_uri(), 'cursor',
+                                            encode_cursor([hits[-1].rank, hits[-1].event_id]))
+
+        rows = list(serializer.values(Event.objects.filter(id__in=[hit.event_id for hit in hits]), ('id',)))
+        events = {row['id']: data for row, data in zip(rows, serializer.to_representation(rows))}
+        data = []
+        for hit in hits:
+            if hit.event_id in events:
+                row = events[hit.event_id]
+                row['rank'] = hit.rank
+                row['snippet'] = hit.snippet
+                data.append(row)
+
+        if unpaginated:
+            return Response(data)
+        return Response({'next': next_link, 'results': data})
+
+
+class EventNearbyView(APIView):
+    # events within radius_km of (lat, lon), closest first
+    def get(self, request):
+        try:
+            lat = float(request.query_params['lat'])
+            lon = float(request.query_params['lon'])
+            radius_km = float(request.query_params.get('radius_km', settings.NEARBY_DEFAULT_RADIUS_KM))
+        except (KeyError, ValueError):
+            return Response({'error': 'lat and lon are required and must be numbers', 'code': 'INVALID_COORDINATES'},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        serializer = EventSerializer(events, many=True)
-        return Response(serializer.data)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return Response({'error': 'lat or lon out of range', 'code': 'INVALID_COORDINATES'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < radius_km <= settings.NEARBY_MAX_RADIUS_KM:
+            return Response({
+                'error': 'radius_km must be between 0 and {}'.format(settings.NEARBY_MAX_RADIUS_KM),
+                'code': 'INVALID_RADIUS'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        ordering = request.query_params.get('ordering', 'distance')
+        if ordering not in ('distance', 'date'):
+            return Response({'error': 'ordering must be distance or date', 'code': 'INVALID_ORDERING'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # indexed geohash/bounding box prefilter, exact distance only on the candidates
+        serializer = EventCompactSerializer(request)
+        events = []
+        for event in serializer.values(Event.objects.filter(nearby_filter(lat, lon, radius_km)),
+                                       ('id', 'date', 'lat', 'lon')):
+            event['distance_km'] = haversine_km(lat, lon, event['lat'], event['lon'])
+            if event['distance_km'] <= radius_km:
+                events.append(event)
+
+        if ordering == 'distance':
+            def key(event):
+                return event['distance_km'], event['id']
+        else:
+            def key(event):
+                return event['date'].timestamp(), event['id']
+        events.sort(key=key)
+
+        page, next_link = paginate_sorted(events, key, request)
+        rows = events if page is None else page
+        data = serializer.to_representation(rows)
+        for row, event in zip(data, rows):
+            row['distance_km'] = round(event['distance_km'], 3)
+
+        if page is None:
+            return Response(data)
+        return Response({'next': next_link, 'results': data})
 
 
 class EventListDeleteView(generics.ListCreateAPIView):
@@ -305,9 +480,7 @@ class EventListDeleteView(generics.ListCreateAPIView):
 
     def delete(self, request, *args, **kwargs):
         try:
-            events = self.queryset.all()
-            for event in events:
-                event.delete()
+            delete_events(self.queryset.all())
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Event.DoesNotExist:
             return Response(
@@ -319,14 +492,16 @@ class EventListDeleteView(generics.ListCreateAPIView):
 
 
 # class to view a single event
+@method_decorator(cache_response(event_kwarg='pk'), name='dispatch')
 class EventRetrieveViewDestroy(generics.RetrieveUpdateDestroyAPIView):
     queryset = Event.objects.all()
     serializer_class = EventSerializer
 
     def get(self, request, *args, **kwargs):
         try:
-            event = self.queryset.get(pk=kwargs["pk"])
-            return Response(EventSerializer(event).data)
+            event = self.queryset.prefetch_related('tags').get(pk=kwargs["pk"])
+            data = EventSerializer(event).data
+            return Response(data, headers={'ETag': event_etag(event, data)})
         except Event.DoesNotExist:
             return Response(
                 data={
@@ -335,24 +510,52 @@ class EventRetrieveViewDestroy(generics.RetrieveUpdateDestroyAPIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
+    def patch(self, request, *args, **kwargs):
+        """
+        Validated partial update that writes only the changed columns (see
+        EventSerializer.update). The event row is locked for the edit, and with
+        If-Match the edit fails with 412 when another edit came first.
+        """
+        versions = if_match_versions(request)
+        with transaction.atomic():
+            try:
+                event = self.queryset.select_for_update().get(pk=kwargs["pk"])
+            except Event.DoesNotExist:
+                return Response(
+                    data={
+                        "message": "Event with id: {} does not exist".format(kwargs["pk"])
+                    },
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            if versions is not None and event.version not in versions:
+                return Response({'error': 'The event was edited in the meantime, fetch it again',
+                                 'code': 'EVENT_EDITED'}, status=status.HTTP_412_PRECONDITION_FAILED)
+
+            serializer = EventSerializer(event, data=request.data, partial=True)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            old_capacity, old_date = event.capacity, event.date
+            event = serializer.save()
+            if event.date != old_date:
+                # the calendar bumps the new month of the event, the old one moves too
+                bump_calendar_months(old_date)
+            if event.capacity > old_capacity:
+                # the new seats go to the waitlist first
+                promote_waiting([event.pk])
+                event.refresh_from_db(fields=['capacity_left', 'reservation_count'])
+
+        data = EventSerializer(event).data
+        return Response(data, headers={'ETag': event_etag(event, data)})
+
     def put(self, request, *args, **kwargs):
-        try:
-            event = self.queryset.get(pk=kwargs["pk"])
-            serializer = EventSerializer()
-            updated_event = serializer.update(event, request.data)
-            return Response(EventSerializer(updated_event).data)
-        except Event.DoesNotExist:
-            return Response(
-                data={
-                    "message": "Event with id: {} does not exist".format(kwargs["pk"])
-                },
-                status=status.HTTP_404_NOT_FOUND
-            )
+        # the existing clients send a subset of the fields with PUT as well, it's the same partial update
+        return self.patch(request, *args, **kwargs)
 
     def delete(self, request, *args, **kwargs):
         try:
-            event = self.queryset.get(pk=kwargs["pk"])
-            event.delete()
+            events = self.queryset.filter(pk=kwargs["pk"])
+            if not delete_events(events):
+                raise Event.DoesNotExist
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Event.DoesNotExist:
             return Response(
@@ -368,9 +571,23 @@ class EventListRetrieveViewGivenMonth(generics.ListCreateAPIView):
     serializer_class = EventSerializer
 
     def get(self, request, *args, **kwargs):
+        month = kwargs["pk"]
+        try:
+            year = int(request.query_params.get('year', timezone.now().year))
+            start = timezone.make_aware(datetime.datetime(year, month, 1))
+            end = timezone.make_aware(datetime.datetime(year + month // 12, month % 12 + 1, 1))
+        except (TypeError, ValueError, OverflowError):
+            return Response(
+                data={
+                    "message": "Invalid month: {}".format(month)
+                },
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         try:
-            events = self.queryset.filter(date__month=kwargs["pk"])
-            return Response(EventSerializer(events, many=True).data)
+            # a date range instead of date__month so the lookup can use the index on date
+            events = self.queryset.filter(date__gte=start, date__lt=end).order_by('date', 'id')
+            return Response(EventCompactSerializer(request).serialize(events))
         except Event.DoesNotExist:
             return Response(
                 data={
@@ -380,6 +597,99 @@ class EventListRetrieveViewGivenMonth(generics.ListCreateAPIView):
             )
 
 
+# Most used tags (page_size of them) with their number of events, ?upcoming=true counts the upcoming events only
+@method_decorator(cache_response(), name='dispatch')
+class TagCloudView(APIView):
+    def get(self, request):
+        limit = get_page_size(request)
+        count = Count('event_tags')
+        if request.query_params.get('upcoming', 'false').lower() in ('true', '1', 'yes'):
+            count = Count('event_tags', filter=Q(event_tags__event__date__gte=timezone.now()))
+        # one query grouped by tag, on the (tag, event) index
+        tags = Tag.objects.annotate(count=count).filter(count__gt=0).order_by('-count', 'name')
+        return Response(list(tags.values('name', 'count')[:limit]), status=status.HTTP_200_OK)
+
+
+# capacity_left of the events of ?ids=1,2,3, with an ETag for conditional polls. The
+# ASGI deployment streams the changes or holds the conditional polls (api/async_views.py)
+class EventCapacityView(APIView):
+    errors = {
+        'MISSING_EVENT_IDS': 'A comma separated list of event IDs is required',
+        'INVALID_EVENT_ID': 'Event IDs must be integers',
+        'TOO_MANY_EVENTS': 'At most {} events per request'.format(settings.LIVE_MAX_EVENTS),
+    }
+
+    @classmethod
+    def parse_event_ids(cls, request):
+        # (event ids, None) or (None, error code)
+        ids = [event_id for event_id in request.GET.get('ids', '').split(',') if event_id.strip()]
+        if not ids:
+            return None, 'MISSING_EVENT_IDS'
+        if len(ids) > settings.LIVE_MAX_EVENTS:
+            return None, 'TOO_MANY_EVENTS'
+        try:
+            return list(dict.fromkeys(int(event_id) for event_id in ids)), None
+        except ValueError:
+            return None, 'INVALID_EVENT_ID'
+
+    @staticmethod
+    def payload(capacity):
+        return {'events': [{'event_id': event_id, 'capacity_left': capacity_left}
+                           for event_id, capacity_left in sorted(capacity.items())]}
+
+    def perform_content_negotiation(self, request, force=False):
+        # an EventSource asking for text/event-stream gets the JSON of a conditional poll
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request):
+        event_ids, code = self.parse_event_ids(request)
+        if code is not None:
+            return Response({'error': self.errors[code], 'code': code}, status=status.HTTP_400_BAD_REQUEST)
+        capacity = dict(Event.objects.filter(pk__in=event_ids).values_list('id', 'capacity_left'))
+        etag = capacity_etag(capacity)
+        response = Response(self.payload(capacity), headers={'ETag': etag})
+        return get_conditional_response(request, etag=etag, response=response)
+
+
+# Events and remaining seats per day (or month) of a date range, for the calendar
+class EventCalendarView(APIView):
+    def get(self, request):
+        group = request.query_params.get('group', 'day')
+        if group not in ('day', 'month'):
+            return Response({'error': 'Group must be day or month', 'code': 'INVALID_GROUP'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # the current month by default, both bounds are inclusive
+        today = timezone.localdate()
+        try:
+            start = request.query_params.get('start')
+            start = parse_date(start) if start else today.replace(day=1)
+            end = request.query_params.get('end')
+            end = parse_date(end) if end else start and last_day_of_month(start)
+        except ValueError:
+            # well formed but out of range, e.g. 2026-02-30
+            start = end = None
+        if start is None or end is None or end < start:
+            return Response({'error': 'Start and end must be dates, start first', 'code': 'INVALID_DATE'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if (end - start).days >= settings.CALENDAR_MAX_DAYS:
+            return Response({
+                'error': 'At most {} days per request'.format(settings.CALENDAR_MAX_DAYS),
+                'code': 'RANGE_TOO_LARGE'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = calendar_days(start, end) if group == 'day' else calendar_months(start, end)
+        return Response({
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'group': group,
+            'results': [
+                {'date': day.isoformat(), 'events': events, 'capacity_left': capacity_left}
+                for day, events, capacity_left in rows
+            ],
+        }, status=status.HTTP_200_OK)
+
+
 # should find users who had a reservations for a given event ID
 # query the reservation table for the event ID
 # then query the user table for the user ID
@@ -390,17 +700,16 @@ class EventRetrieveAttendeesGivenEvent(generics.ListAPIView):
 
     def get(self, request, *args, **kwargs):
         try:
-            reservations = Reservation.objects.filter(event_id=kwargs["pk"])
-            print(reservations.values())
-            if len(reservations) == 0:
+            # users joined with their reservations for the event, evaluated once
+            users = UserCompactSerializer(request).serialize(User.objects.filter(reservation__event_id=kwargs["pk"]))
+            if not users:
                 return Response(
                     data={
                         "message": "No reservations for event with id: {}".format(kwargs["pk"])
                     },
                     status=status.HTTP_404_NOT_FOUND
                 )
-            users = User.objects.filter(id__in=[reservation.user_id_id for reservation in reservations])
-            return Response(UserSerializer(users, many=True).data)
+            return Response(users)
         except Reservation.DoesNotExist:
             return Response(
                 data={
@@ -417,7 +726,7 @@ class EventRetrieveReservationsGivenEvent(generics.ListCreateAPIView):
     def get(self, request, *args, **kwargs):
         try:
             reservations = Reservation.objects.filter(event_id=kwargs["pk"])
-            return Response(ReservationSerializer(reservations, many=True).data)
+            return Response(ReservationCompactSerializer(request).serialize(reservations))
         except Reservation.DoesNotExist:
             return Response(
                 data={
@@ -428,19 +737,23 @@ class EventRetrieveReservationsGivenEvent(generics.ListCreateAPIView):
 
 
 # Class to view all reservations
-class ReservationListRetrieveView(generics.ListCreateAPIView):
+class ReservationListRetrieveView(CompactListMixin, generics.ListCreateAPIView):
     queryset = Reservation.objects.all()
     serializer_class = ReservationSerializer
+    compact_serializer_class = ReservationCompactSerializer
+    pagination_class = ReservationPagination
 
 
 class UserReservationCountView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         try:
-            # Count reservations for the authenticated user
-            reservation_count = Reservation.objects.filter(user=request.user).count()
+            # Read the counter kept with the reservations instead of counting them
+            reservation_count = User.objects.filter(pk=request.user.pk).values_list(
+                'reservation_count', flat=True
+            ).first()
 
             return Response({
                 'reservation_count': reservation_count
@@ -461,7 +774,7 @@ class ReservationListRetrieveViewGivenEvent(generics.ListCreateAPIView):
     def get(self, request, *args, **kwargs):
         try:
             reservations = self.queryset.filter(event_id=kwargs["pk"])
-            return Response(ReservationSerializer(reservations, many=True).data)
+            return Response(ReservationCompactSerializer(request).serialize(reservations))
         except Reservation.DoesNotExist:
             return Response(
                 data={
@@ -472,9 +785,8 @@ class ReservationListRetrieveViewGivenEvent(generics.ListCreateAPIView):
 
     def delete(self, request, *args, **kwargs):
         try:
-            reservations = self.queryset.filter(event_id=kwargs["pk"])
-            for reservation in reservations:
-                reservation.delete()
+            # gives every seat back, the waitlist of the event takes them first
+            delete_reservations(self.queryset.filter(event_id=kwargs["pk"]))
             return Response(status=status.HTTP_204_NO_CONTENT)
         except Reservation.DoesNotExist:
             return Response(
@@ -485,6 +797,44 @@ class ReservationListRetrieveViewGivenEvent(generics.ListCreateAPIView):
             )
 
 
+# Streaming NDJSON/CSV exports of reservations with the attendee's username and email,
+# ?output=ndjson|csv, ?since= and ?until= bound the reservation date
+class ReservationExportView(APIView):
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def export(self, request, queryset, filename):
+        output = request.query_params.get('output', 'ndjson')
+        if output not in EXPORT_CONTENT_TYPES:
+            return Response({
+                'error': 'output must be one of: {}'.format(', '.join(EXPORT_CONTENT_TYPES)),
+                'code': 'INVALID_OUTPUT'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            queryset = filter_created_at(queryset, request.query_params.get('since'),
+                                         request.query_params.get('until'))
+        except ValueError as e:
+            return Response({'error': str(e), 'code': 'INVALID_DATE'}, status=status.HTTP_400_BAD_REQUEST)
+        return export_reservations(request, queryset, output, filename)
+
+
+# reservations of an event, for its creator
+class EventReservationsExportView(ReservationExportView):
+    def get(self, request, pk):
+        event = get_object_or_404(Event.objects.only('id', 'creator_id'), pk=pk)
+        if event.creator_id != request.user.id and not request.user.is_staff:
+            raise PermissionDenied("You don't have permission to export the reservations of this event.")
+        return self.export(request, Reservation.objects.filter(event_id=pk), 'event-{}-reservations'.format(pk))
+
+
+# every reservation, admins only
+class ReservationsExportView(ReservationExportView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return self.export(request, Reservation.objects.all(), 'reservations')
+
+
 # reservation create delete
 class ReservationCreateDeleteViewGivenUser(generics.CreateAPIView):
     queryset = Reservation.objects.all()
@@ -493,7 +843,7 @@ class ReservationCreateDeleteViewGivenUser(generics.CreateAPIView):
     # post should check if the user is already registered for the event
     def post(self, request, *args, **kwargs):
         try:
-            reservation = self.queryset.get(event_id=kwargs["pk"], username=kwargs["username"])
+            reservation = self.queryset.get(event_id=kwargs["pk"], user__username=kwargs["username"])
             return Response(
                 data={
                     "message": "User already registered for this event"
@@ -508,26 +858,13 @@ class ReservationCreateDeleteViewGivenUser(generics.CreateAPIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class CreateEventView(APIView):
+class CreateEventView(EventCreateMixin, APIView):
     permission_classes = (permissions.IsAuthenticated,)
 
-    def post(self, request):
-        # if not request.user.has_perm('your_app.add_event'):
-        #     raise PermissionDenied("You don't have permission to create events.")
-
-        print(request.data)
-
-        serializer = EventSerializer(data=request.data)
-        if serializer.is_valid():
-            # Add the current user as the creator of the event
-            serializer.save(creator=request.user)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
 
 ## View to make a new reservation
 class CreateReservationView(APIView):
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
@@ -535,26 +872,213 @@ class CreateReservationView(APIView):
         if not event_id:
             return Response({'error': 'Event ID is required', 'code': 'MISSING_EVENT_ID'},
                             status=status.HTTP_400_BAD_REQUEST)
+        try:
+            event_id = int(event_id)
+        except (TypeError, ValueError):
+            return Response({'error': 'Event ID must be an integer', 'code': 'INVALID_EVENT_ID'},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        event = get_object_or_404(Event, id=event_id)
+        # Take a seat and count the reservation with a single conditional UPDATE,
+        # the database serializes concurrent bookings on the event row so
+        # capacity_left can't go below 0. The unique (user, event) constraint
+        # rejects a second reservation, which rolls the seat back with the rest
+        # of the transaction.
+        try:
+            with transaction.atomic():
+                booked = Event.objects.filter(pk=event_id, capacity_left__gt=0).update(
+                    capacity_left=F('capacity_left') - 1, reservation_count=F('reservation_count') + 1
+                )
+                if not booked:
+                    if not Event.objects.filter(pk=event_id).exists():
+                        raise Http404('No Event matches the given query.')
+                    return Response({'error': 'This event is fully booked', 'code': 'EVENT_FULL'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+                # bulk_create doesn't send post_save, the event is counted above, like BatchReservationView.book
+                reservation, = Reservation.objects.bulk_create([Reservation(user=request.user, event_id=event_id)])
+                User.objects.filter(pk=request.user.pk).update(reservation_count=F('reservation_count') + 1)
+                # a seat freed while the user was waiting for one
+                WaitlistEntry.objects.filter(user=request.user, event_id=event_id).delete()
+                invalidate_reserved_event_ids(request.user.pk)
+                bump_events_version(event_id, listed=False)
+        except IntegrityError:
+            return Response({'error': 'You already have a reservation for this event', 'code': 'RESERVATION_EXISTS'},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        if event.capacity_left <= 0:
-            return Response({'error': 'This event is fully booked', 'code': 'EVENT_FULL'},
+        serializer = ReservationSerializer(reservation)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+# Waitlist of a fully booked event: POST joins it, GET returns the position of the user, DELETE leaves it
+class EventWaitlistView(APIView):
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    errors = {
+        'EVENT_NOT_FULL': 'This event has free seats, book one instead',
+        'RESERVATION_EXISTS': 'You already have a reservation for this event',
+        'ALREADY_WAITLISTED': 'You are already on the waitlist of this event',
+    }
+
+    def get(self, request, pk):
+        position = waitlist_position(request.user, pk)
+        if position is None:
+            return Response({'error': 'You are not on the waitlist of this event', 'code': 'NOT_WAITLISTED'},
+                            status=status.HTTP_404_NOT_FOUND)
+        ticket, position = position
+        return Response({'event_id': pk, 'ticket': ticket, 'position': position}, status=status.HTTP_200_OK)
+
+    def post(self, request, pk):
+        try:
+            with transaction.atomic():
+                if Event.objects.filter(pk=pk, date__lt=timezone.now()).exists():
+                    return Response({'error': 'Cannot join the waitlist of past events', 'code': 'PAST_EVENT'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                join_waitlist(request.user, pk)
+                ticket, position = waitlist_position(request.user, pk)
+        except Event.DoesNotExist:
+            return Response({'error': 'Event not found', 'code': 'EVENT_NOT_FOUND'},
+                            status=status.HTTP_404_NOT_FOUND)
+        except WaitlistError as e:
+            return Response({'error': self.errors[e.code], 'code': e.code}, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError:
+            # a concurrent request of the same user
+            return Response({'error': self.errors['ALREADY_WAITLISTED'], 'code': 'ALREADY_WAITLISTED'},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        existing_reservation = Reservation.objects.filter(user=request.user, event=event).first()
-        if existing_reservation:
-            return Response({'error': 'You already have a reservation for this event', 'code': 'RESERVATION_EXISTS'},
+        return Response({'event_id': pk, 'ticket': ticket, 'position': position},
+                        status=status.HTTP_201_CREATED)
+
+    def delete(self, request, pk):
+        deleted, _ = WaitlistEntry.objects.filter(user=request.user, event_id=pk).delete()
+        if not deleted:
+            return Response({'error': 'You are not on the waitlist of this event', 'code': 'NOT_WAITLISTED'},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response({'message': 'You left the waitlist', 'event_id': pk}, status=status.HTTP_200_OK)
+
+
+class _BatchConflict(Exception):
+    # a concurrent request changed one of the rows between the checks and the writes
+    pass
+
+
+# Book or cancel a list of events in one transaction, with a result per event
+class BatchReservationView(APIView):
+    authentication_classes = [CachedJWTAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    errors = {
+        'EVENT_NOT_FOUND': 'Event not found',
+        'EVENT_FULL': 'This event is fully booked',
+        'RESERVATION_EXISTS': 'You already have a reservation for this event',
+        'RESERVATION_NOT_FOUND': 'No reservation found for this event',
+        'PAST_EVENT': 'Cannot remove reservation for past events',
+    }
+
+    def post(self, request):
+        action = request.data.get('action')
+        if action not in ('book', 'cancel'):
+            return Response({'error': 'Action must be book or cancel', 'code': 'INVALID_ACTION'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        event_ids = request.data.get('event_ids')
+        if not event_ids or not isinstance(event_ids, list):
+            return Response({'error': 'A list of event IDs is required', 'code': 'MISSING_EVENT_IDS'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(event_ids) > settings.RESERVATION_BATCH_MAX_SIZE:
+            return Response({
+                'error': 'At most {} events per request'.format(settings.RESERVATION_BATCH_MAX_SIZE),
+                'code': 'BATCH_TOO_LARGE'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # keep the order of the request, drop duplicates
+            event_ids = list(dict.fromkeys(int(event_id) for event_id in event_ids))
+        except (TypeError, ValueError):
+            return Response({'error': 'Event IDs must be integers', 'code': 'INVALID_EVENT_ID'},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        reservation = Reservation(user=request.user, event=event)
-        reservation.save()
+        try:
+            with transaction.atomic():
+                if action == 'book':
+                    failures, done = self.book(request.user, event_ids)
+                else:
+                    failures, done = self.cancel(request.user, event_ids)
+                if done:
+                    invalidate_reserved_event_ids(request.user.pk)
+        except (_BatchConflict, IntegrityError):
+            return Response({'error': 'The events changed during the request, try again', 'code': 'BATCH_CONFLICT'},
+                            status=status.HTTP_409_CONFLICT)
+
+        results = []
+        for event_id in event_ids:
+            if event_id in failures:
+                code = failures[event_id]
+                results.append({'event_id': event_id, 'status': 'failed', 'error': self.errors[code], 'code': code})
+            else:
+                results.append({'event_id': event_id, 'status': 'booked' if action == 'book' else 'cancelled'})
+
+        return Response({'action': action, 'done': len(done), 'results': results}, status=status.HTTP_200_OK)
+
+    def book(self, user, event_ids):
+        # lock the event rows so the checks below still hold when the seats are taken
+        capacity_left = dict(
+            Event.objects.select_for_update().filter(pk__in=event_ids).values_list('id', 'capacity_left')
+        )
+        reserved = set(
+            Reservation.objects.filter(user=user, event_id__in=capacity_left).values_list('event_id', flat=True)
+        )
+
+        failures = {}
+        bookable = []
+        for event_id in event_ids:
+            if event_id not in capacity_left:
+                failures[event_id] = 'EVENT_NOT_FOUND'
+            elif capacity_left[event_id] <= 0:
+                failures[event_id] = 'EVENT_FULL'
+            elif event_id in reserved:
+                failures[event_id] = 'RESERVATION_EXISTS'
+            else:
+                bookable.append(event_id)
 
-        event.capacity_left -= 1
-        event.save()
+        if bookable:
+            booked = Event.objects.filter(pk__in=bookable, capacity_left__gt=0).update(
+                capacity_left=F('capacity_left') - 1, reservation_count=F('reservation_count') + 1
+            )
+            if booked != len(bookable):
+                raise _BatchConflict()
+            Reservation.objects.bulk_create([Reservation(user=user, event_id=event_id) for event_id in bookable])
+            WaitlistEntry.objects.filter(user=user, event_id__in=bookable).delete()
+            # bulk_create doesn't send post_save
+            User.objects.filter(pk=user.pk).update(reservation_count=F('reservation_count') + len(bookable))
+            bump_events_version(*bookable, listed=False)
+        return failures, bookable
+
+    def cancel(self, user, event_ids):
+        dates = dict(Event.objects.filter(pk__in=event_ids).values_list('id', 'date'))
+        reserved = set(
+            Reservation.objects.filter(user=user, event_id__in=dates).values_list('event_id', flat=True)
+        )
 
-        serializer = ReservationSerializer(reservation)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        now = timezone.now()
+        failures = {}
+        cancellable = []
+        for event_id in event_ids:
+            if event_id not in dates:
+                failures[event_id] = 'EVENT_NOT_FOUND'
+            elif event_id not in reserved:
+                failures[event_id] = 'RESERVATION_NOT_FOUND'
+            elif dates[event_id] < now:
+                failures[event_id] = 'PAST_EVENT'
+            else:
+                cancellable.append(event_id)
+
+        if cancellable:
+            deleted, _ = Reservation.objects.filter(user=user, event_id__in=cancellable).delete()
+            if deleted != len(cancellable):
+                raise _BatchConflict()
+            Event.objects.filter(pk__in=cancellable).update(capacity_left=F('capacity_left') + 1)
+            promote_waiting(cancellable)
+        return failures, cancellable
 
 
 # Geocoding
@@ -569,22 +1093,8 @@ class GeocodeView(APIView):
         if not api_key:
             return Response({'error': 'API key not configured'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # Example API endpoint (replace with your actual geocoding service URL)
-        geocoding_api_url = 'https://geocoding.openapi.it/geocode'
-
-        # Body of the request
-        data = {"address": address}
-
-        # Headers including the API token
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
-
         try:
-            response = requests.post(geocoding_api_url, headers=headers, json=data)
-            response.raise_for_status()  # Raises an HTTPError for bad responses
-            data = response.json()
+            data = geocode(address)
 
             if data['success']:
                 element = data['element']
@@ -598,5 +1108,15 @@ class GeocodeView(APIView):
             else:
                 return Response({'error': 'No results found'}, status=status.HTTP_404_NOT_FOUND)
 
-        except requests.RequestException as e:
+        except (requests.RequestException, ValueError) as e:
             return Response({'error': f'API request failed: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# Hit, miss and latency counters of the geocoding cache
+class GeocodeStatsView(APIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        stats = get_stats()
+        stats['entries'] = GeocodeCacheEntry.objects.count()
+        return Response(stats, status=status.HTTP_200_OK)
@@ -0,0 +1,92 @@
+from django.conf import settings
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .caching import bump_events_version, invalidate_reserved_event_ids
+from .counters import count_reservations
+from .models import Event, Reservation, WaitlistEntry
+
+
+class WaitlistError(Exception):
+    # why a user can't join a waitlist, code is the error code of the API response
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def join_waitlist(user, event_id):
+    """
+    Queues user for a seat of a fully booked event, returns the WaitlistEntry.
+    The ticket is handed out by the tail counter of the event, the conditional
+    UPDATE serializes concurrent joins and cancellations on the event row.
+    Raises Event.DoesNotExist or WaitlistError. Run it in a transaction.
+    """
+    queued = Event.objects.filter(pk=event_id, capacity_left__lte=0).update(waitlist_tail=F('waitlist_tail') + 1)
+    if not queued:
+        if not Event.objects.filter(pk=event_id).exists():
+            raise Event.DoesNotExist
+        # a seat is free, book it instead
+        raise WaitlistError('EVENT_NOT_FULL')
+    if Reservation.objects.filter(user=user, event_id=event_id).exists():
+        raise WaitlistError('RESERVATION_EXISTS')
+    if WaitlistEntry.objects.filter(user=user, event_id=event_id).exists():
+        raise WaitlistError('ALREADY_WAITLISTED')
+    tail = Event.objects.filter(pk=event_id).values_list('waitlist_tail', flat=True).get()
+    return WaitlistEntry.objects.create(user=user, event_id=event_id, ticket=tail - 1)
+
+
+def waitlist_position(user, event_id):
+    """
+    (ticket, position) of user in the waitlist of the event, position 1 is
+    promoted next, or None. The entry is looked up on the unique (user, event)
+    index and the entries ahead of it are counted on the (event, ticket) one,
+    so the users who left the waitlist no longer count.
+    """
+    ticket = WaitlistEntry.objects.filter(user=user, event_id=event_id).values_list('ticket', flat=True).first()
+    if ticket is None:
+        return None
+    return ticket, WaitlistEntry.objects.filter(event_id=event_id, ticket__lt=ticket).count() + 1
+
+
+def promote_waiting(event_ids, chunk_size=None):
+    """
+    Gives the free seats of the events to their waitlists, oldest ticket
+    first, and returns the ids of the promoted users. Run it in the
+    transaction that gave the seats back. The entries are popped with
+    SELECT ... FOR UPDATE SKIP LOCKED, so concurrent cancellations promote
+    different users instead of waiting for each other's entry; on SQLite the
+    IMMEDIATE transactions already serialize the writers.
+    """
+    chunk_size = chunk_size or settings.BULK_DELETE_CHUNK_SIZE
+    event_ids = list(event_ids)
+    promoted = []
+    for start in range(0, len(event_ids), chunk_size):
+        # the counters rule out most events without touching the waitlist table
+        free_seats = Event.objects.filter(
+            pk__in=event_ids[start:start + chunk_size], capacity_left__gt=0, waitlist_tail__gt=F('waitlist_head')
+        ).values_list('id', 'capacity_left')
+        for event_id, seats in free_seats:
+            # a user booked by the creator may still be waiting, they leave the waitlist instead of a second seat
+            WaitlistEntry.objects.filter(
+                event_id=event_id, user__in=Reservation.objects.filter(event_id=event_id).values('user_id')
+            ).delete()
+            entries = list(
+                WaitlistEntry.objects.select_for_update(skip_locked=True).filter(event_id=event_id)
+                .order_by('ticket').values_list('id', 'user_id', 'ticket')[:seats]
+            )
+            if not entries:
+                continue
+            WaitlistEntry.objects.filter(pk__in=[pk for pk, _, _ in entries]).delete()
+            user_ids = [user_id for _, user_id, _ in entries]
+            Reservation.objects.bulk_create([Reservation(user_id=user_id, event_id=event_id) for user_id in user_ids])
+            # bulk_create doesn't send post_save, the promoted users take the seats
+            count_reservations([(user_id, event_id) for user_id in user_ids], 1, seats=True)
+            # a concurrent promotion may have skipped past a locked entry, the head only moves forward
+            Event.objects.filter(pk=event_id).update(
+                waitlist_head=Greatest(F('waitlist_head'), Value(entries[-1][2] + 1))
+            )
+            bump_events_version(event_id, listed=False)
+            promoted += user_ids
+    if promoted:
+        invalidate_reserved_event_ids(*promoted)
+    return promoted
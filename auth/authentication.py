@@ -0,0 +1,82 @@
+import threading
+import time
+
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from api.caching import AUTH_USER_FIELDS, get_auth_user, set_auth_user
+from api.models import UserProfile
+
+# the cached fields in model order, as Model.from_db() expects the values
+_FIELDS = tuple(field.attname for field in UserProfile._meta.concrete_fields if field.attname in AUTH_USER_FIELDS)
+
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    # time spent resolving users, split by cache outcome
+    'hit_seconds': 0.0,
+    'miss_seconds': 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+def _count(hit, seconds):
+    with _stats_lock:
+        _stats['hits' if hit else 'misses'] += 1
+        _stats['hit_seconds' if hit else 'miss_seconds'] += seconds
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+    # every hit would otherwise have cost an average miss
+    if stats['hits'] and stats['misses']:
+        average_hit = stats['hit_seconds'] / stats['hits']
+        average_miss = stats['miss_seconds'] / stats['misses']
+        stats['seconds_saved'] = stats['hits'] * max(0.0, average_miss - average_hit)
+    else:
+        stats['seconds_saved'] = 0.0
+    return stats
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the user of a token from the cache instead
+    of querying the database on every request. The active flag and the core
+    fields (api.caching.AUTH_USER_FIELDS) are cached for AUTH_USER_CACHE_TIMEOUT
+    seconds; the user is rebuilt from them with the remaining fields deferred.
+    Password changes, logout, deactivation and deletion invalidate the entry.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # the check needs the password hash, which is never cached
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        started = time.perf_counter()
+        key, values = get_auth_user(user_id)
+        if values is not None:
+            _count(True, time.perf_counter() - started)
+        else:
+            values = UserProfile.objects.filter(
+                **{api_settings.USER_ID_FIELD: user_id}
+            ).values_list(*_FIELDS).first()
+            if values is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            set_auth_user(key, values)
+            _count(False, time.perf_counter() - started)
+
+        user = UserProfile.from_db(DEFAULT_DB_ALIAS, _FIELDS, values)
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
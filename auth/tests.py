@@ -1,3 +1,55 @@
-from django.test import TestCase
+from django.contrib.auth.signals import user_login_failed
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from api.models import UserProfile
+
+
+# the settings redirect plain HTTP to HTTPS, the test client speaks HTTP
+@override_settings(SECURE_SSL_REDIRECT=False)
+class UserLoginTests(TestCase):
+    def setUp(self):
+        self.user = UserProfile.objects.create_user(username='ada', email='Ada@Example.com', password='password-ada')
+        self.failures = []
+        user_login_failed.connect(self.login_failed)
+        self.addCleanup(user_login_failed.disconnect, self.login_failed)
+
+    def login_failed(self, sender, credentials, request, **kwargs):
+        self.failures.append(credentials)
+
+    def login(self, **data):
+        return APIClient().post('/auth/login', data, format='json')
+
+    def test_email_in_any_case(self):
+        response = self.login(email='ada@example.com', password='password-ada')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['username'], 'ada')
+        self.assertEqual(self.failures, [])
+
+    def test_email_of_several_accounts(self):
+        UserProfile.objects.create_user(username='ada2', email='ada@example.com', password='password-ada')
+
+        response = self.login(email='ada@example.com', password='password-ada')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(self.failures), 1)
+        # the username still logs in
+        self.assertEqual(self.login(username='ada2', password='password-ada').status_code, 200)
+
+    def test_failed_login_signal(self):
+        self.assertEqual(self.login(username='ada', password='wrong-password').status_code, 400)
+        self.assertEqual(self.login(username='nobody', password='password-ada').status_code, 400)
+
+        self.assertEqual(self.failures, [
+            {'username': 'ada', 'password': '********************'},
+            {'username': 'nobody', 'password': '********************'},
+        ])
+
+    def test_disabled_account(self):
+        UserProfile.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        response = self.login(username='ada', password='password-ada')
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(len(self.failures), 1)
@@ -10,4 +10,5 @@ urlpatterns = [
     path('user', views.UserView.as_view(), name='user'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('change-password', views.ChangePasswordView.as_view(), name='change_password'),
+    path('cache-stats', views.AuthCacheStatsView.as_view(), name='auth_cache_stats'),
 ]
@@ -1,5 +1,6 @@
 from django.core.exceptions import ValidationError
-from django.contrib.auth import get_user_model, authenticate
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_login_failed
 from django.core.validators import validate_email as django_validate_email
 
 UserModel = get_user_model()
@@ -32,44 +33,56 @@ def registration_validation(data):
     return data
 
 
-def validate_login(data):
+def login_failed(data, request=None):
+    # the signal authenticate() sends on a failed login, for the receivers that throttle or audit them
+    credentials = {key: data.get(key) for key in ('email', 'username') if data.get(key)}
+    credentials['password'] = '********************'
+    user_login_failed.send(sender=__name__, credentials=credentials, request=request)
+
+
+def validate_login(data, request=None):
+    # one user query and one password hash verification per login,
+    # the caller checks user.is_active
     email = data.get('email', '').strip().lower()
     username = data.get('username', '').strip()
     password = data.get('password', '').strip()
 
     # Check if login is using email or username
-    if email:
-        if not username:
-            try:
-                django_validate_email(email)
-            except ValidationError:
-                raise ValidationError('Invalid email format')
-
-            try:
-                username = UserModel.objects.get(email=email).username
-            except UserModel.DoesNotExist:
-                raise ValidationError('No user found with this email address')
+    if email and not username:
+        try:
+            django_validate_email(email)
+        except ValidationError:
+            raise ValidationError('Invalid email format')
+        # emails are stored as written at registration and aren't unique
+        users = UserModel.objects.filter(email__iexact=email)
+        not_found = 'No user found with this email address'
     elif username:
-        if not UserModel.objects.filter(username=username).exists():
-            raise ValidationError('No user found with this username')
+        users = UserModel.objects.filter(username=username)
+        not_found = 'No user found with this username'
     else:
         raise ValidationError('Either email or username is required')
 
     if not password:
         raise ValidationError('Password is required')
 
-    user = authenticate(username=username, password=password)
-
-    if user is None:
+    users = list(users[:2])
+    if not users:
+        login_failed(data, request)
+        raise ValidationError(not_found)
+    if len(users) > 1:
+        login_failed(data, request)
+        raise ValidationError('More than one account uses this email address, log in with the username')
+    user = users[0]
+
+    # rehashes and saves the password when it isn't stored with the preferred hasher (settings.PASSWORD_HASHER)
+    if not user.check_password(password):
+        login_failed(data, request)
         raise ValidationError('Invalid credentials')
 
-    if not user.is_active:
-        raise ValidationError('This account is inactive')
-
     return {
         'user': user,
         'email': email,
-        'username': username,
+        'username': user.username,
         'password': password,
     }
 
@@ -3,12 +3,13 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
 from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from django.contrib.auth import authenticate, update_session_auth_hash
+from django.contrib.auth import update_session_auth_hash
 from api.models import UserProfile as UserModel
+from api.caching import invalidate_auth_user
 from api.serializers import UserSerializer
+from .authentication import CachedJWTAuthentication, get_stats
 from .serializers import UserRegisterSerializer
-from .validations import registration_validation, validate_login
+from .validations import login_failed, registration_validation, validate_login
 from django.core.exceptions import ValidationError
 
 
@@ -35,22 +36,15 @@ class UserLogin(APIView):
 
     def post(self, request):
         try:
-            clean_data = validate_login(request.data)
+            clean_data = validate_login(request.data, request)
         except ValidationError as e:
             return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        username = clean_data.get('username')
-        password = clean_data.get('password')
-
-        if not username or not password:
-            return Response({'error': 'Both username and password are required'}, status=status.HTTP_400_BAD_REQUEST)
-
-        user = authenticate(username=username, password=password)
-
-        if user is None:
-            return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+        # validate_login already fetched the user and verified the password
+        user = clean_data['user']
 
         if not user.is_active:
+            login_failed(request.data, request)
             return Response({'error': 'User account is disabled'}, status=status.HTTP_403_FORBIDDEN)
 
         refresh = RefreshToken.for_user(user)
@@ -84,7 +78,7 @@ class UserRegistration(APIView):
 
 
 class UserLogout(APIView):
-    authentication_classes = (JWTAuthentication,)
+    authentication_classes = (CachedJWTAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def post(self, request):
@@ -92,13 +86,14 @@ class UserLogout(APIView):
             refresh_token = request.data["refresh"]
             token = RefreshToken(refresh_token)
             token.blacklist()
+            invalidate_auth_user(request.user.pk)
             return Response({"success": "Successfully logged out"}, status=status.HTTP_200_OK)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 class UserView(APIView):
-    authentication_classes = (JWTAuthentication,)
+    authentication_classes = (CachedJWTAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def get(self, request):
@@ -107,7 +102,7 @@ class UserView(APIView):
 
 
 class ChangePasswordView(APIView):
-    authentication_classes = (JWTAuthentication,)
+    authentication_classes = (CachedJWTAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
 
     def post(self, request):
@@ -131,6 +126,7 @@ class ChangePasswordView(APIView):
 
         # Add any additional password validation here (e.g., minimum length, complexity)
 
+        # saving the user also drops its cached authentication (api/signals.py)
         user.set_password(new_password)
         user.save()
 
@@ -138,3 +134,11 @@ class ChangePasswordView(APIView):
         update_session_auth_hash(request, user)
 
         return Response({'message': 'Password successfully changed'}, status=status.HTTP_200_OK)
+
+
+# Hit ratio and time saved by the cached JWT user resolution
+class AuthCacheStatsView(APIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return Response(get_stats(), status=status.HTTP_200_OK)
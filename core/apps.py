@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from .middleware import install_query_recorder
+        # SQL statements count towards the request metrics of the middleware
+        connection_created.connect(install_query_recorder)
@@ -0,0 +1,444 @@
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.utils import timezone
+
+# name -> function(command, options), run by `manage.py benchmark <name>`
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def median_ms(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+@contextmanager
+def count_statements():
+    # yields a one item list holding the number of SQL statements run so far in the block
+    count = [0]
+
+    def wrapper(execute, sql, params, many, context):
+        count[0] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(wrapper):
+        yield count
+
+
+def migrate_to(app_label, migration_name):
+    # the models of the app as they were at the given migration
+    call_command('migrate', app_label, migration_name, verbosity=0)
+    return MigrationExecutor(connection).loader.project_state((app_label, migration_name)).apps
+
+
+def seed_reservations(apps, rows, batch_size=10000):
+    """
+    Creates about sqrt(rows) * 2 users, enough events to give each of them a
+    reservation on every event, and `rows` reservations. Returns (user ids, event ids).
+    """
+    User = apps.get_model('api', 'UserProfile')
+    Event = apps.get_model('api', 'Event')
+    Reservation = apps.get_model('api', 'Reservation')
+
+    user_count = max(1, int(rows ** 0.5) * 2)
+    event_count = max(1, -(-rows // user_count))
+    users = User.objects.bulk_create(
+        [User(username='bench{}'.format(i), email='bench{}@example.com'.format(i), password='!')
+         for i in range(user_count)],
+        batch_size=batch_size
+    )
+    now = timezone.now()
+    events = Event.objects.bulk_create(
+        [Event(name='Event {}'.format(i), description='Benchmark event', creator=users[i % user_count],
+               date=now + timedelta(hours=(i * 7919) % (24 * 730) - 24 * 365), location='Somewhere',
+               lat=0, lon=0, capacity=user_count, capacity_left=user_count)
+         for i in range(event_count)],
+        batch_size=batch_size
+    )
+    user_ids = [user.pk for user in users]
+    event_ids = [event.pk for event in events]
+
+    for start in range(0, rows, batch_size):
+        Reservation.objects.bulk_create([
+            Reservation(user_id=user_ids[i % user_count], event_id=event_ids[i // user_count])
+            for i in range(start, min(rows, start + batch_size))
+        ])
+    return user_ids, event_ids
+
+
+def hot_queries(apps, user_id, event_id):
+    # the queries api/views.py runs the most
+    Event = apps.get_model('api', 'Event')
+    Reservation = apps.get_model('api', 'Reservation')
+    now = timezone.now()
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    month_end = (month_start + timedelta(days=32)).replace(day=1)
+    return [
+        ('upcoming events', Event.objects.filter(date__gte=now).order_by('date', 'id')[:50]),
+        ('events of a month, date__month', Event.objects.filter(date__month=now.month)),
+        ('events of a month, date range',
+         Event.objects.filter(date__gte=month_start, date__lt=month_end).order_by('date', 'id')),
+        ('events by creator', Event.objects.filter(creator_id=user_id)),
+        ('is reserved', Reservation.objects.filter(user_id=user_id, event_id=event_id)[:1]),
+        ('reserved event ids of a user', Reservation.objects.filter(user_id=user_id).values_list('event_id')),
+        ('reservations of an event',
+         Reservation.objects.filter(event_id=event_id).order_by('created_at', 'id')[:50]),
+    ]
+
+
+@scenario('query_plans')
+def query_plans(command, options):
+    # EXPLAIN and median timing of the hot queries before and after the indexes of migration 0008
+    rows = options['rows'] or 1000000
+    apps = migrate_to('api', '0007_geocodecacheentry')
+    command.stdout.write('Seeding {} reservations...'.format(rows))
+    user_ids, event_ids = seed_reservations(apps, rows)
+    user_id, event_id = user_ids[len(user_ids) // 2], event_ids[len(event_ids) // 2]
+
+    for label, migration in (('before', '0007_geocodecacheentry'), ('after', '0008_query_indexes')):
+        apps = migrate_to('api', migration)
+        command.stdout.write(command.style.MIGRATE_HEADING('{} ({})'.format(label, migration)))
+        for name, queryset in hot_queries(apps, user_id, event_id):
+            elapsed = median_ms(lambda: list(queryset.all()), options['repeat'])
+            command.stdout.write('  {}: {:.3f} ms'.format(name, elapsed))
+            for line in queryset.explain().splitlines():
+                command.stdout.write('      ' + line)
+
+
+def seed_event_with_reservations(rows, batch_size=10000):
+    # one event with `rows` reservations from as many users
+    from api.models import Event, Reservation, UserProfile
+
+    users = UserProfile.objects.bulk_create(
+        [UserProfile(username='attendee{}'.format(i), email='attendee{}@example.com'.format(i), password='!')
+         for i in range(rows)],
+        batch_size=batch_size
+    )
+    event = Event.objects.create(name='Big event', description='Benchmark event', creator=users[0],
+                                 date=timezone.now() + timedelta(days=30), location='Somewhere',
+                                 lat=0, lon=0, capacity=rows, capacity_left=0)
+    Reservation.objects.bulk_create([Reservation(user=user, event=event) for user in users], batch_size=batch_size)
+    return event
+
+
+@scenario('bulk_delete')
+def bulk_delete(command, options):
+    # deleting every reservation of one large event, chunked raw deletes against the ORM cascade
+    from api.bulk import delete_events, delete_in_chunks, delete_reservations
+    from api.models import Event, Reservation, UserProfile
+
+    def delete_one_by_one(event):
+        for reservation in Reservation.objects.filter(event=event):
+            reservation.delete()
+
+    rows = options['rows'] or 100000
+    for name, delete in (
+        ('api.bulk.delete_reservations', lambda event: delete_reservations(Reservation.objects.filter(event=event))),
+        ('QuerySet.delete()', lambda event: Reservation.objects.filter(event=event).delete()),
+        ('one delete() per row', delete_one_by_one),
+    ):
+        command.stdout.write('Seeding an event with {} reservations...'.format(rows))
+        event = seed_event_with_reservations(rows)
+        with count_statements() as statements:
+            started = time.perf_counter()
+            delete(event)
+            elapsed = time.perf_counter() - started
+        command.stdout.write('  {}: {:.2f} s, {} statements'.format(name, elapsed, statements[0]))
+        delete_events(Event.objects.all())
+        delete_in_chunks(UserProfile.objects.all(), chunk_size=5000)
+
+
+@scenario('serializers')
+def serializers(command, options):
+    # ModelSerializer on model instances against the compact .values() serializers of the list endpoints
+    from api.models import Event, EventTag, Reservation, Tag, UserProfile
+    from api.serializers import (EventCompactSerializer, EventSerializer, ReservationCompactSerializer,
+                                 ReservationSerializer, UserCompactSerializer, UserSerializer)
+
+    rows = options['rows'] or 10000
+    command.stdout.write('Seeding {} users, events and reservations...'.format(rows))
+    event = seed_event_with_reservations(rows)
+    Event.objects.bulk_create(
+        [Event(name='Event {}'.format(i), description='Benchmark event', creator_id=event.creator_id,
+               date=event.date + timedelta(hours=i), location='Somewhere', lat=0, lon=0, capacity=10,
+               capacity_left=10)
+         for i in range(rows - 1)],
+        batch_size=10000
+    )
+    tag = Tag.objects.create(name='bench')
+    EventTag.objects.bulk_create([EventTag(event_id=pk, tag=tag) for pk in Event.objects.values_list('pk', flat=True)],
+                                 batch_size=10000)
+
+    for model, serializer, compact in (
+        (Event, EventSerializer, EventCompactSerializer),
+        (Reservation, ReservationSerializer, ReservationCompactSerializer),
+        (UserProfile, UserSerializer, UserCompactSerializer),
+    ):
+        queryset = model.objects.order_by('pk')
+        # the tags of the instances in one query, as the compact serializer reads them
+        instances = queryset.prefetch_related('tags') if model is Event else queryset
+        # api.tests.CompactSerializerTests checks the same on a few rows
+        if serializer(instances, many=True).data != compact().serialize(queryset):
+            raise CommandError('{} and {} give different outputs'.format(serializer.__name__, compact.__name__))
+        before = median_ms(lambda: serializer(instances.all(), many=True).data, options['repeat'])
+        after = median_ms(lambda: compact().serialize(queryset.all()), options['repeat'])
+        command.stdout.write(command.style.MIGRATE_HEADING('{} ({} rows)'.format(model.__name__, queryset.count())))
+        command.stdout.write('  {}: {:.1f} ms'.format(serializer.__name__, before))
+        command.stdout.write('  {}: {:.1f} ms ({:.1f}x)'.format(compact.__name__, after, before / after))
+
+
+@scenario('login')
+def login(command, options):
+    # logins per second on one core for each password hasher, through the login endpoint
+    from django.conf import settings
+    from django.contrib.auth import authenticate
+    from django.test import override_settings
+    from rest_framework.test import APIClient
+
+    from api.models import UserProfile
+
+    repeat = options['rows'] or 20
+    client = APIClient()
+    for algorithm, hasher in settings.PASSWORD_HASHER_PATHS.items():
+        hashers = [hasher] + [other for other in settings.PASSWORD_HASHERS if other != hasher]
+        with override_settings(PASSWORD_HASHERS=hashers):
+            username = 'login_{}'.format(algorithm)
+            UserProfile.objects.create_user(username=username, email=username + '@example.com', password='benchmark')
+            credentials = {'username': username, 'password': 'benchmark'}
+
+            with count_statements() as statements:
+                response = client.post('/auth/login', credentials, format='json', secure=True)
+            assert response.status_code == 200, response.content
+            login_ms = median_ms(lambda: client.post('/auth/login', credentials, format='json', secure=True), repeat)
+            # the former flow: a lookup, then authenticate() twice
+            before_ms = median_ms(
+                lambda: (UserProfile.objects.filter(username=username).exists(),
+                         authenticate(**credentials), authenticate(**credentials)),
+                repeat
+            )
+
+        command.stdout.write(command.style.MIGRATE_HEADING(algorithm))
+        command.stdout.write('  login endpoint: {:.1f} ms, {:.1f} logins/s, {} statements'.format(
+            login_ms, 1000 / login_ms, statements[0]))
+        command.stdout.write('  lookup + authenticate() twice: {:.1f} ms, {:.1f} logins/s'.format(
+            before_ms, 1000 / before_ms))
+
+
+def describe_database():
+    # backend and connection handling of the benchmarked database
+    settings_dict = connection.settings_dict
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+        return 'sqlite {} (journal_mode={})'.format(settings_dict['NAME'], journal_mode)
+    pool = settings_dict['OPTIONS'].get('pool')
+    connections = 'pool {}'.format(pool) if pool else 'CONN_MAX_AGE={}'.format(settings_dict['CONN_MAX_AGE'])
+    return '{} {} ({})'.format(connection.vendor, settings_dict['NAME'], connections)
+
+
+@scenario('throughput')
+def throughput(command, options):
+    # requests per second of concurrent clients booking, reading their reservation count and cancelling
+    import random
+    import threading
+
+    from django.db import connections
+    from rest_framework.test import APIClient
+
+    from api.models import Event, UserProfile
+
+    requests = options['rows'] or 3000
+    concurrency = options['concurrency']
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        # the connections of the threads would share one in-memory database with table locks
+        raise CommandError('The test database is in memory, set DATABASE_TEST_PATH to benchmark a database file.')
+    command.stdout.write(describe_database())
+
+    users = UserProfile.objects.bulk_create(
+        [UserProfile(username='client{}'.format(i), email='client{}@example.com'.format(i), password='!')
+         for i in range(concurrency)]
+    )
+    event_ids = [event.pk for event in Event.objects.bulk_create(
+        [Event(name='Event {}'.format(i), description='Benchmark event', creator=users[0],
+               date=timezone.now() + timedelta(days=30), location='Somewhere', lat=0, lon=0,
+               capacity=concurrency, capacity_left=concurrency)
+         for i in range(50)]
+    )]
+    # each client repeats book, count, cancel
+    rounds = max(1, requests // (3 * concurrency))
+    errors = []
+
+    def client(user):
+        api = APIClient()
+        api.force_authenticate(user)
+        try:
+            for _ in range(rounds):
+                event_id = random.choice(event_ids)
+                for response in (
+                    api.post('/reservations/new', {'event_id': event_id}, format='json', secure=True),
+                    api.get('/users/number-of-reservations/', secure=True),
+                    api.post('/reservations/{}/remove'.format(event_id), secure=True),
+                ):
+                    if response.status_code >= 400:
+                        errors.append(response.status_code)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=client, args=(user,)) for user in users]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = rounds * 3 * concurrency
+    command.stdout.write('  {} requests from {} clients: {:.1f} requests/s, {} errors'.format(
+        total, concurrency, total / elapsed, len(errors)))
+    if errors:
+        # run by CI on both database engines, a failed request is a regression
+        raise CommandError('{} requests failed: {}'.format(len(errors), sorted(set(errors))))
+
+
+@scenario('waitlist')
+def waitlist(command, options):
+    # concurrent cancellations on a fully booked event promoting its waitlist: fairness and cancellations per second
+    import threading
+
+    from django.db import connections
+    from rest_framework.test import APIClient
+
+    from api.models import Event, Reservation, UserProfile, WaitlistEntry
+
+    rows = options['rows'] or 1000
+    concurrency = options['concurrency']
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        raise CommandError('The test database is in memory, set DATABASE_TEST_PATH to benchmark a database file.')
+    command.stdout.write(describe_database())
+
+    # `rows` attendees holding every seat and as many users waiting, tickets in joining order
+    holders = UserProfile.objects.bulk_create(
+        [UserProfile(username='holder{}'.format(i), email='holder{}@example.com'.format(i), password='!')
+         for i in range(rows)]
+    )
+    waiting = UserProfile.objects.bulk_create(
+        [UserProfile(username='waiting{}'.format(i), email='waiting{}@example.com'.format(i), password='!')
+         for i in range(rows)]
+    )
+    event = Event.objects.create(name='Sold out', description='Benchmark event', creator=holders[0],
+                                 date=timezone.now() + timedelta(days=30), location='Somewhere', lat=0, lon=0,
+                                 capacity=rows, capacity_left=0, reservation_count=rows, waitlist_tail=rows)
+    Reservation.objects.bulk_create([Reservation(user=user, event=event) for user in holders])
+    WaitlistEntry.objects.bulk_create(
+        [WaitlistEntry(user=user, event=event, ticket=ticket) for ticket, user in enumerate(waiting)]
+    )
+
+    # half of the holders cancel, spread over the threads
+    cancelling = holders[:rows // 2]
+    errors = []
+
+    def client(users):
+        api = APIClient()
+        try:
+            for user in users:
+                api.force_authenticate(user)
+                response = api.post('/reservations/{}/remove'.format(event.pk), secure=True)
+                if response.status_code >= 400:
+                    errors.append(response.status_code)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=client, args=(cancelling[i::concurrency],)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    # fair: the promoted users are exactly the first tickets, whatever order the cancellations committed in
+    promoted = set(Reservation.objects.filter(event=event, user__in=waiting).values_list('user_id', flat=True))
+    first_tickets = {user.pk for user in waiting[:len(cancelling) - len(errors)]}
+    event.refresh_from_db()
+    command.stdout.write('  {} cancellations from {} clients: {:.1f} cancellations/s, {} errors'.format(
+        len(cancelling), concurrency, len(cancelling) / elapsed, len(errors)))
+    command.stdout.write('  promoted {} users, in ticket order: {}, capacity_left {}, waitlist head {}'.format(
+        len(promoted), promoted == first_tickets, event.capacity_left, event.waitlist_head))
+    # api.tests.ConcurrentWaitlistTests checks the same on a few users
+    if promoted != first_tickets or event.capacity_left != 0:
+        raise CommandError('The waitlist was promoted out of ticket order or a seat was lost')
+
+
+
+@scenario('quota')
+def quota(command, options):
+    # concurrent event creations by one user at the edge of the quota: none beyond it, creations per second
+    import threading
+
+    from django.db import connections
+    from rest_framework.test import APIClient
+
+    from api.models import Event, Subscription, UserProfile
+
+    requests = options['rows'] or 400
+    concurrency = options['concurrency']
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        raise CommandError('The test database is in memory, set DATABASE_TEST_PATH to benchmark a database file.')
+    command.stdout.write(describe_database())
+
+    user = UserProfile.objects.create(username='creator', email='creator@example.com', password='!')
+    # half the requests fit in the quota, an expired subscription must not count
+    allowed = requests // 2
+    subscription = Subscription.objects.create(user=user, max_amount=allowed, amount_left=allowed,
+                                               due_date=timezone.now() + timedelta(days=30))
+    Subscription.objects.create(user=user, max_amount=requests, amount_left=requests,
+                                due_date=timezone.now() - timedelta(days=1))
+    event = {'name': 'New event', 'description': 'Benchmark event', 'creator': user.pk,
+             'date': (timezone.now() + timedelta(days=7)).isoformat(), 'location': 'Somewhere',
+             'lat': 0, 'lon': 0, 'capacity': 10, 'capacity_left': 10}
+    statuses = []
+
+    def client(count):
+        api = APIClient()
+        api.force_authenticate(user)
+        try:
+            for _ in range(count):
+                statuses.append(api.post('/events/new', event, format='json', secure=True).status_code)
+        finally:
+            connections.close_all()
+
+    threads = [threading.Thread(target=client, args=(len(range(i, requests, concurrency)),)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    subscription.refresh_from_db()
+    created = Event.objects.filter(creator=user).count()
+    command.stdout.write('  {} requests from {} clients: {:.1f} requests/s'.format(
+        requests, concurrency, requests / elapsed))
+    command.stdout.write('  {} created (quota {}), {} refused, amount_left {}, other statuses {}'.format(
+        statuses.count(201), allowed, statuses.count(403), subscription.amount_left,
+        sorted(set(statuses) - {201, 403})))
+    if created != allowed or subscription.amount_left != 0:
+        raise CommandError('{} events created for a quota of {}'.format(created, allowed))
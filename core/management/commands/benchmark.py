@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = ('Runs a benchmark scenario on a throwaway test database, '
+            'the data of the configured database is not touched')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument('--rows', type=int, help='Rows to seed, the default depends on the scenario')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs of every timed operation')
+        parser.add_argument('--concurrency', type=int, default=8, help='Threads of the concurrent scenarios')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            SCENARIOS[options['scenario']](self, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,84 @@
+import asyncio
+import statistics
+import time
+
+import httpx
+from django.core.management.base import BaseCommand
+
+
+def percentile(samples, fraction):
+    # nearest-rank percentile of sorted samples
+    return samples[min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))]
+
+
+async def run_load(url, requests, concurrency, method='GET', headers=None, verify=True):
+    """
+    Sends `requests` requests to url from `concurrency` concurrent clients
+    sharing one connection pool. Returns (latencies in seconds of the
+    successful requests, errors, wall clock seconds).
+    """
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(headers=headers, verify=verify, limits=limits, timeout=30) as client:
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, url)
+                    await response.aread()
+                    if response.status_code >= 400:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return sorted(latencies), errors, elapsed
+
+
+class Command(BaseCommand):
+    help = ('Load tests one or more URLs and reports requests per second and latency percentiles, '
+            'e.g. the same endpoint on the WSGI and on the ASGI deployment')
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='Full URLs, tested one after the other')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per URL')
+        parser.add_argument('--concurrency', type=int, default=50, help='Concurrent clients')
+        parser.add_argument('--warmup', type=int, default=100, help='Untimed requests sent first to every URL')
+        parser.add_argument('--method', default='GET')
+        parser.add_argument('--header', action='append', default=[], help='"Name: value", can be repeated')
+        parser.add_argument('--insecure', action='store_true', help="Don't verify TLS certificates")
+
+    def handle(self, *args, **options):
+        headers = dict(header.split(':', 1) for header in options['header'])
+        headers = {name.strip(): value.strip() for name, value in headers.items()}
+        verify = not options['insecure']
+        concurrency = options['concurrency']
+
+        for url in options['urls']:
+            if options['warmup']:
+                asyncio.run(run_load(url, options['warmup'], concurrency, options['method'], headers, verify))
+            latencies, errors, elapsed = asyncio.run(
+                run_load(url, options['requests'], concurrency, options['method'], headers, verify)
+            )
+
+            self.stdout.write(self.style.MIGRATE_HEADING(url))
+            if not latencies:
+                self.stdout.write('  all {} requests failed'.format(errors))
+                continue
+            self.stdout.write('  {:.1f} requests/s, {} errors'.format(len(latencies) / elapsed, errors))
+            self.stdout.write('  latency ms: mean {:.1f}  p50 {:.1f}  p95 {:.1f}  p99 {:.1f}  max {:.1f}'.format(
+                statistics.mean(latencies) * 1000,
+                percentile(latencies, 0.50) * 1000,
+                percentile(latencies, 0.95) * 1000,
+                percentile(latencies, 0.99) * 1000,
+                latencies[-1] * 1000,
+            ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.counters import drifted_events, drifted_users, repair_events, repair_users
+
+
+class Command(BaseCommand):
+    help = ('Recounts the reservations of every event and user and repairs the reservation_count '
+            'and capacity_left counters that drifted from them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report the drifted rows without repairing them')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            event_ids = list(drifted_events())
+            user_ids = list(drifted_users())
+            self.stdout.write(f'{len(event_ids)} events and {len(user_ids)} users have drifted counters.')
+            if options['dry_run'] or not (event_ids or user_ids):
+                return
+            repair_events(event_ids)
+            repair_users(user_ids)
+
+        self.stdout.write(self.style.SUCCESS(f'Repaired {len(event_ids)} events and {len(user_ids)} users.'))
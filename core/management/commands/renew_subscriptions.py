@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import Subscription
+from api.subscriptions import renew_expired
+
+
+class Command(BaseCommand):
+    help = ('Refills the event quota of the subscriptions that are due and moves their due date '
+            'one period forward, with a single UPDATE. Meant to run periodically, e.g. daily from cron')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report the due subscriptions without renewing them')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        if options['dry_run']:
+            due = Subscription.objects.filter(due_date__lte=now).count()
+            self.stdout.write(f'{due} subscriptions are due.')
+            return
+
+        renewed = renew_expired(now)
+        self.stdout.write(self.style.SUCCESS(f'Renewed {renewed} subscriptions.'))
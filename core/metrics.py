@@ -0,0 +1,115 @@
+import bisect
+import threading
+
+# upper bounds of the buckets of each metric, an overflow bucket follows the last one
+SECONDS_BUCKETS = tuple(0.0005 * 2 ** i for i in range(18))  # 0.5 ms to about 65 s
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144, 233, 377, 610, 987)
+BYTES_BUCKETS = tuple(64 * 4 ** i for i in range(12))  # 64 B to 256 MiB
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# name -> (help, buckets), all labelled by route and method
+METRICS = {
+    'fenfesta_request_duration_seconds': ('Wall time of the request', SECONDS_BUCKETS),
+    'fenfesta_request_db_queries': ('SQL statements run by the request', COUNT_BUCKETS),
+    'fenfesta_request_db_duration_seconds': ('Time spent in SQL statements', SECONDS_BUCKETS),
+    'fenfesta_request_serialization_duration_seconds': ('Time spent rendering the response body', SECONDS_BUCKETS),
+    'fenfesta_response_size_bytes': ('Size of the response body, streaming responses excluded', BYTES_BUCKETS),
+}
+
+
+class Histogram:
+    """
+    Fixed bucket histogram, memory doesn't grow with the number of samples.
+    Quantiles are interpolated linearly inside their bucket, as Prometheus'
+    histogram_quantile() does, so they are as precise as the buckets.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if not self.count:
+            return float('nan')
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    # the overflow bucket has no upper bound
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Registry:
+    # the metrics of this process, a multi-process server has one registry per worker
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.requests = {}
+
+    def observe(self, route, method, status, values):
+        # values: metric name -> value, metrics without a value for this request are left out
+        with self.lock:
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for name, value in values.items():
+                histogram = self.histograms.get((name, route, method))
+                if histogram is None:
+                    histogram = self.histograms[name, route, method] = Histogram(METRICS[name][1])
+                histogram.observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.requests.clear()
+
+    def render(self):
+        """
+        The metrics in the Prometheus text exposition format: a request
+        counter and a summary with QUANTILES, sum and count per metric.
+        """
+        with self.lock:
+            lines = [
+                '# HELP fenfesta_requests_total Requests handled',
+                '# TYPE fenfesta_requests_total counter',
+            ]
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append('fenfesta_requests_total{{{}}} {}'.format(
+                    _labels(route=route, method=method, status=status), count))
+
+            for name, (help_text, _) in METRICS.items():
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} summary'.format(name))
+                for (metric, route, method), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for q in QUANTILES:
+                        lines.append('{}{{{}}} {!r}'.format(
+                            name, _labels(route=route, method=method, quantile=q), histogram.quantile(q)))
+                    labels = _labels(route=route, method=method)
+                    lines.append('{}_sum{{{}}} {!r}'.format(name, labels, histogram.sum))
+                    lines.append('{}_count{{{}}} {}'.format(name, labels, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    return ','.join('{}="{}"'.format(name, _escape(value)) for name, value in labels.items())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
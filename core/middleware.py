@@ -0,0 +1,126 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .metrics import registry
+
+slow_query_logger = logging.getLogger('fenfesta.slow_queries')
+slow_request_logger = logging.getLogger('fenfesta.slow_requests')
+
+# sample of the request being handled, sync_to_async() copies it to the thread running the queries
+_current_sample = ContextVar('request_metrics_sample', default=None)
+
+
+class _RequestSample:
+    # what one request spent, filled in by the middleware hooks below
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.render_seconds = None
+        self.route = None
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_seconds += elapsed
+            if elapsed * 1000 >= settings.SLOW_QUERY_THRESHOLD_MS:
+                slow_query_logger.warning('%.1f ms %s: %s', elapsed * 1000, self.route or '-', sql)
+
+    def render_started(self, response):
+        started = time.perf_counter()
+
+        def render_finished(response):
+            self.render_seconds = (self.render_seconds or 0.0) + time.perf_counter() - started
+        response.add_post_render_callback(render_finished)
+
+    def finish(self, request, response):
+        elapsed = time.perf_counter() - self.started
+        match = getattr(request, 'resolver_match', None)
+        # the URL pattern rather than the URL name, several patterns share a name
+        route = match.route if match is not None else 'unmatched'
+        values = {
+            'fenfesta_request_duration_seconds': elapsed,
+            'fenfesta_request_db_queries': self.queries,
+            'fenfesta_request_db_duration_seconds': self.db_seconds,
+        }
+        if self.render_seconds is not None:
+            values['fenfesta_request_serialization_duration_seconds'] = self.render_seconds
+        if not response.streaming:
+            values['fenfesta_response_size_bytes'] = len(response.content)
+        registry.observe(route, request.method, response.status_code, values)
+
+        if elapsed * 1000 >= settings.SLOW_REQUEST_THRESHOLD_MS:
+            slow_request_logger.warning(
+                '%.1f ms %s %s (%s) status %s, %d queries in %.1f ms', elapsed * 1000, request.method,
+                request.get_full_path(), route, response.status_code, self.queries, self.db_seconds * 1000
+            )
+
+
+def record_query(execute, sql, params, many, context):
+    # execute wrapper of every connection (see install_query_recorder), a no-op outside requests
+    sample = _current_sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    return sample.execute(execute, sql, params, many, context)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    # connection_created receiver, connected by CoreConfig.ready()
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the wall time, SQL statements, SQL time, rendering time and
+    response size of every request into core.metrics.registry, labelled with
+    the URL pattern and the method, and logs the statements and requests
+    slower than SLOW_QUERY_THRESHOLD_MS and SLOW_REQUEST_THRESHOLD_MS. Put it
+    first in MIDDLEWARE so the wall time covers the other middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        sample = request._metrics_sample = _RequestSample()
+        token = _current_sample.set(sample)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_sample.reset(token)
+        sample.finish(request, response)
+        return response
+
+    async def __acall__(self, request):
+        sample = request._metrics_sample = _RequestSample()
+        token = _current_sample.set(sample)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_sample.reset(token)
+        sample.finish(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # the route is known once the URL is resolved, for the slow query log
+        request._metrics_sample.route = request.resolver_match.route
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the view returns, time the rendering
+        request._metrics_sample.render_started(response)
+        return response
@@ -1,3 +1,87 @@
-from django.test import TestCase
+import math
+from datetime import timedelta
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.models import Event, UserProfile
+
+from .metrics import Histogram, Registry, registry
+
+
+class HistogramTests(TestCase):
+    def test_quantiles(self):
+        histogram = Histogram((1, 2, 4))
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe(value)
+
+        self.assertEqual((histogram.count, histogram.sum), (4, 6.5))
+        # interpolated inside the bucket: the median is the 2nd of 4, the 1st of the 2 in (1, 2]
+        self.assertEqual(histogram.quantile(0.5), 1.5)
+        self.assertEqual(histogram.quantile(1), 4)
+
+    def test_overflow_and_empty(self):
+        histogram = Histogram((1, 2))
+        self.assertTrue(math.isnan(histogram.quantile(0.5)))
+
+        histogram.observe(100)
+
+        # the overflow bucket has no upper bound, its quantiles are the last bound
+        self.assertEqual(histogram.quantile(0.99), 2)
+
+    def test_label_escaping(self):
+        metrics = Registry()
+        metrics.observe('events/"quoted"\\', 'GET', 200, {'fenfesta_request_db_queries': 1})
+
+        self.assertIn('route="events/\\"quoted\\"\\\\"', metrics.render())
+
+
+# the settings redirect plain HTTP to HTTPS, the test client speaks HTTP
+@override_settings(SECURE_SSL_REDIRECT=False)
+class MetricsViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.addCleanup(registry.reset)
+        creator = UserProfile.objects.create_user(username='creator', password='password-creator')
+        for days in (1, 2):
+            Event.objects.create(name='Event', description='Description', creator=creator, location='Somewhere',
+                                 date=timezone.now() + timedelta(days=days), lat=41.9, lon=12.5, capacity=10,
+                                 capacity_left=10)
+        self.admin = APIClient()
+        self.admin.force_authenticate(UserProfile.objects.create_user(username='admin', is_staff=True))
+
+    def metrics(self):
+        response = self.admin.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return response.content.decode().splitlines()
+
+    def test_admins_only(self):
+        self.assertIn(APIClient().get('/metrics').status_code, (401, 403))
+
+    def test_request_metrics(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get('/events/?page_size=1')
+        self.assertEqual(response.status_code, 200)
+        # the next request empties the query log
+        query_count = len(queries)
+        APIClient().get('/events/?page_size=1')
+
+        lines = self.metrics()
+
+        self.assertIn('fenfesta_requests_total{route="events/",method="GET",status="200"} 2', lines)
+        self.assertIn('# TYPE fenfesta_request_db_queries summary', lines)
+        labels = 'route="events/",method="GET"'
+        # the second request is a cached response, without queries
+        self.assertIn('fenfesta_request_db_queries_sum{{{}}} {!r}'.format(labels, float(query_count)), lines)
+        self.assertIn('fenfesta_request_db_queries_count{{{}}} 2'.format(labels), lines)
+        self.assertIn('fenfesta_response_size_bytes_sum{{{}}} {!r}'.format(labels, 2.0 * len(response.content)),
+                      lines)
+        for quantile in (0.5, 0.95, 0.99):
+            self.assertTrue(any(line.startswith('fenfesta_request_duration_seconds{{{},quantile="{}"}} '.format(
+                labels, quantile)) for line in lines))
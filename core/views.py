@@ -1,3 +1,13 @@
-from django.shortcuts import render
+from django.http import HttpResponse
+from rest_framework import permissions
+from rest_framework.views import APIView
 
-# Create your views here.
+from .metrics import registry
+
+
+# Request metrics of this process (see core/middleware.py) in the Prometheus text format
+class MetricsView(APIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
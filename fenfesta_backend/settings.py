@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -20,6 +21,13 @@ load_dotenv()
 GEOCODING_API_KEY = os.getenv('GEOCODING_API_KEY')
 if not GEOCODING_API_KEY:
     raise ValueError("GEOCODING_API_KEY is not set in the environment")
+GEOCODING_API_URL = os.getenv('GEOCODING_API_URL', 'https://geocoding.openapi.it/geocode')
+# (connect, read) timeout of the calls to the geocoder, in seconds
+GEOCODING_TIMEOUT = (float(os.getenv('GEOCODING_CONNECT_TIMEOUT', 3.05)), float(os.getenv('GEOCODING_READ_TIMEOUT', 10)))
+GEOCODING_POOL_SIZE = int(os.getenv('GEOCODING_POOL_SIZE', 10))
+# answers of the geocoder are cached in the database (api.GeocodeCacheEntry)
+GEOCODING_CACHE_TTL = int(os.getenv('GEOCODING_CACHE_TTL', 60 * 60 * 24 * 30))
+GEOCODING_CACHE_MAX_ENTRIES = int(os.getenv('GEOCODING_CACHE_MAX_ENTRIES', 10000))
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -53,6 +61,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so the timings cover the other middleware too
+    'core.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,10 +77,63 @@ REST_FRAMEWORK = {
     #     'rest_framework.permissions.IsAuthenticated',
     # ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # JWTAuthentication with the user resolved from the cache
+        'auth.authentication.CachedJWTAuthentication',
     ),
 }
 
+# Keyset pagination of the list endpoints (see api/pagination.py).
+# Default page size and upper bound for the ?page_size= query parameter
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 50))
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 200))
+
+# /events/nearby search radius, in km
+NEARBY_DEFAULT_RADIUS_KM = float(os.environ.get('NEARBY_DEFAULT_RADIUS_KM', 10))
+NEARBY_MAX_RADIUS_KM = float(os.environ.get('NEARBY_MAX_RADIUS_KM', 200))
+
+# Maximum number of events in a reservations/batch request
+RESERVATION_BATCH_MAX_SIZE = int(os.environ.get('RESERVATION_BATCH_MAX_SIZE', 100))
+
+# Rows per statement (and per transaction) of the set-based deletes in api/bulk.py
+BULK_DELETE_CHUNK_SIZE = int(os.environ.get('BULK_DELETE_CHUNK_SIZE', 500))
+
+# Longest date range in days of the events calendar (see api/calendar.py)
+CALENDAR_MAX_DAYS = int(os.environ.get('CALENDAR_MAX_DAYS', 366))
+
+# Most tags an event can have (see api/tags.py)
+EVENT_MAX_TAGS = int(os.environ.get('EVENT_MAX_TAGS', 20))
+
+# Days between the due dates of a subscription, added by the renew_subscriptions command
+SUBSCRIPTION_PERIOD_DAYS = int(os.environ.get('SUBSCRIPTION_PERIOD_DAYS', 30))
+
+# Events per period of the subscription given to a user who never had one, on their first
+# event creation (see api/subscriptions.py); 0 requires a subscription to create events
+DEFAULT_EVENT_QUOTA = int(os.environ.get('DEFAULT_EVENT_QUOTA', 10))
+
+# Live capacity feed (see api/live.py): most events per subscription, seconds between
+# the version checks of the subscribed events and between full re-reads of them, seconds
+# between keepalives of the event streams and longest wait of a long-poll request
+LIVE_MAX_EVENTS = int(os.environ.get('LIVE_MAX_EVENTS', 100))
+LIVE_POLL_INTERVAL = float(os.environ.get('LIVE_POLL_INTERVAL', 1))
+LIVE_REFRESH_INTERVAL = float(os.environ.get('LIVE_REFRESH_INTERVAL', 15))
+LIVE_KEEPALIVE_INTERVAL = float(os.environ.get('LIVE_KEEPALIVE_INTERVAL', 15))
+LIVE_LONG_POLL_TIMEOUT = float(os.environ.get('LIVE_LONG_POLL_TIMEOUT', 25))
+
+# Rows read per query by the streaming reservation exports (see api/exports.py),
+# also the number of lines sent per chunk
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+
+# Statements and requests slower than these many milliseconds are logged by
+# core.middleware.RequestMetricsMiddleware (loggers fenfesta.slow_queries and fenfesta.slow_requests)
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', 1000))
+
+# Lifetime in seconds of the users cached by auth.authentication.CachedJWTAuthentication
+AUTH_USER_CACHE_TIMEOUT = int(os.environ.get('AUTH_USER_CACHE_TIMEOUT', 60))
+
+# Lifetime in seconds of the cached set of event ids each user has reserved
+RESERVED_EVENTS_CACHE_TIMEOUT = int(os.environ.get('RESERVED_EVENTS_CACHE_TIMEOUT', 300))
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=365),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=365),
@@ -98,6 +161,11 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'fenfesta_backend.wsgi.application'
+ASGI_APPLICATION = 'fenfesta_backend.asgi.application'
+
+# Serve the read endpoints and the geocoding proxy with the async views of
+# api/async_views.py, for deployments on the ASGI application (gunicorn.conf.py)
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False').lower() in ('true', '1', 'yes')
 
 # Use os.environ.get() to provide a fallback
 DATABASE_PATH = os.environ.get('DATABASE_PATH', os.path.join(BASE_DIR, 'db.sqlite3'))
@@ -105,20 +173,78 @@ DATABASE_PATH = os.environ.get('DATABASE_PATH', os.path.join(BASE_DIR, 'db.sqlit
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.sqlite3',
-#         'NAME': BASE_DIR / 'db.sqlite3',
-#     }
-# }
+# sqlite (DATABASE_PATH) by default, postgresql for production (the db service of docker-compose.yaml)
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgresql':
+    # psycopg pool, shared by the threads of a worker process; a checked out
+    # connection is health checked and given back at the end of the request
+    DATABASE_POOL = os.environ.get('DATABASE_POOL', 'True').lower() in ('true', '1', 'yes')
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'fenfesta'),
+            'USER': os.environ.get('POSTGRES_USER', 'fenfesta'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # without the pool, keep the connection of a thread open between requests
+            'CONN_MAX_AGE': 0 if DATABASE_POOL else int(os.environ.get('DATABASE_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
+    }
+    if DATABASE_POOL:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 2)),
+            # at least the threads of a worker (gunicorn.conf.py), or requests wait for a connection
+            'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 10)),
+            # seconds a request waits for a free connection before failing
+            'timeout': float(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+        }
+elif DATABASE_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': DATABASE_PATH,
+            'OPTIONS': {
+                # WAL lets readers run during a write, synchronous=NORMAL is safe with WAL
+                # and syncs at checkpoints only
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+                # seconds a write waits for the lock of another connection
+                'timeout': float(os.environ.get('DATABASE_BUSY_TIMEOUT', 20)),
+                # take the write lock when the transaction starts, a deferred transaction
+                # that reads and then writes fails at once with "database is locked"
+                'transaction_mode': 'IMMEDIATE',
+            },
+            # a file with WAL rather than the in-memory default, the concurrency tests and benchmarks
+            # run threads with their own connections; created and destroyed by the test runner
+            'TEST': {'NAME': os.environ.get('DATABASE_TEST_PATH',
+                                            os.path.join(tempfile.gettempdir(), 'fenfesta_test.sqlite3'))},
+        }
+    }
+else:
+    raise ValueError('DATABASE_ENGINE must be sqlite or postgresql, not {!r}'.format(DATABASE_ENGINE))
 
-# Docker database
-DATABASES = {
+# Cache
+# locmem by default, any Django cache backend (e.g. redis) can be set from the environment.
+# locmem is per process: gunicorn.conf.py refuses to start more than one worker with it
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': DATABASE_PATH,
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'fenfesta'),
     }
 }
+if CACHES['default']['BACKEND'].endswith('LocMemCache'):
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 10000))}
+
+# Lifetime in seconds of the cached public event responses (see api/caching.py),
+# writes invalidate them earlier
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 60))
+
+# Seconds a cached event list may show the seats and counters from before the last
+# reservations (see api/caching.py), 0 rebuilds it after each one
+EVENT_LIST_SEATS_MAX_AGE = float(os.environ.get('EVENT_LIST_SEATS_MAX_AGE', 5))
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -138,12 +264,20 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
-PASSWORD_HASHERS = [
-    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
-    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
-    "django.contrib.auth.hashers.Argon2PasswordHasher",
-    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
-    "django.contrib.auth.hashers.ScryptPasswordHasher",
+PASSWORD_HASHER_PATHS = {
+    'pbkdf2_sha256': "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    'pbkdf2_sha1': "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    'argon2': "django.contrib.auth.hashers.Argon2PasswordHasher",
+    'bcrypt_sha256': "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    'scrypt': "django.contrib.auth.hashers.ScryptPasswordHasher",
+}
+# Hasher of new passwords, one of the keys above. Passwords stored with
+# another hasher keep working and are rehashed with this one on the next login
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2_sha256')
+if PASSWORD_HASHER not in PASSWORD_HASHER_PATHS:
+    raise ValueError("PASSWORD_HASHER must be one of: {}".format(', '.join(PASSWORD_HASHER_PATHS)))
+PASSWORD_HASHERS = [PASSWORD_HASHER_PATHS[PASSWORD_HASHER]] + [
+    hasher for algorithm, hasher in PASSWORD_HASHER_PATHS.items() if algorithm != PASSWORD_HASHER
 ]
 
 AUTH_USER_MODEL = "api.UserProfile"
@@ -179,3 +313,34 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 SECURE_SSL_REDIRECT = True
 SESSION_COOKIE_SECURE = True
 CSRF_COOKIE_SECURE = True
+
+# Logging
+# the slow query and slow request logs of core.middleware go to the console, with the server log
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'default': {
+            'format': '{asctime} {levelname} {name} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'default',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        'fenfesta': {
+            'handlers': ['console'],
+            'level': os.environ.get('LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
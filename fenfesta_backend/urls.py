@@ -22,4 +22,5 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('api.urls')),
     path('auth/', include('auth.urls')),
+    path('', include('core.urls')),
 ]
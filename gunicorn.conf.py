@@ -0,0 +1,41 @@
+# Production server configuration, used by the `asgi` service of docker-compose.yaml:
+#
+#   ASYNC_VIEWS=true gunicorn fenfesta_backend.asgi:application -c gunicorn.conf.py
+#
+# The same file serves the sync WSGI application for comparison (see the loadtest command):
+#
+#   GUNICORN_WORKER_CLASS=gthread gunicorn fenfesta_backend.wsgi:application -c gunicorn.conf.py
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# uvicorn workers run the ASGI application, each one is an event loop in its own process
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'uvicorn.workers.UvicornWorker')
+# every worker opens its own database pool, workers * DATABASE_POOL_MAX_SIZE must fit the
+# max_connections of postgres
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# the invalidations of api/caching.py (reserved events, authenticated users, event versions)
+# only reach the other workers through a shared cache, a per-process locmem cache would
+# keep serving stale data from them
+cache_backend = os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+if workers > 1 and cache_backend.endswith('LocMemCache'):
+    raise RuntimeError('{} workers need a shared cache, set CACHE_BACKEND (e.g. redis, see '
+                       'docker-compose.yaml) or WEB_CONCURRENCY=1'.format(workers))
+# only used by the gthread worker class of the WSGI deployment
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# recycle workers now and then so a slow leak can't grow without bound
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+# HTTPS, the settings redirect plain HTTP (SECURE_SSL_REDIRECT)
+certfile = os.environ.get('GUNICORN_CERTFILE') or None
+keyfile = os.environ.get('GUNICORN_KEYFILE') or None
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-') or None
+errorlog = '-'